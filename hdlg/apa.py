@@ -0,0 +1,164 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import struct
+from typing import NamedTuple
+
+SECTOR_SIZE = 512
+HEADER_SIZE = 1024
+APA_MAGIC = b"APA\0"
+
+# checksum, magic, next, prev, id, rpwd, fpwd, start, length, type, flags, nsub, created, main, number, modver
+HEADER = struct.Struct("<4s4sII32s8s8sIIHHI8sIII")
+SUB_PARTITION = struct.Struct("<II")
+SUB_PARTITIONS_OFFSET = 512
+MAX_SUB_PARTITIONS = 64
+
+
+class Partition(NamedTuple):
+    """A Partition Header in the APA partition list. Sector values are in 512-byte sectors."""
+    next: int
+    prev: int
+    id: str
+    start: int
+    length: int
+    type: int
+    flags: int
+    main: int
+    number: int
+    subs: tuple[tuple[int, int], ...]
+
+    @property
+    def offset(self) -> int:
+        return self.start * SECTOR_SIZE
+
+    @property
+    def size(self) -> int:
+        return self.length * SECTOR_SIZE
+
+    @property
+    def is_empty(self) -> bool:
+        return self.type == 0
+
+
+def checksum(header: bytes) -> bytes:
+    """Calculate the checksum of a 1024-byte APA header, a 32-bit sum of every word after the checksum."""
+    return struct.pack(
+        "<Q",
+        sum(struct.unpack("<255I", header[4:HEADER_SIZE]))
+    )[:4]
+
+
+def is_valid(header: bytes) -> bool:
+    """Check if a 1024-byte header is an APA header with a correct checksum."""
+    return header[4:8] == APA_MAGIC and header[0:4] == checksum(header)
+
+
+def parse_header(header: bytes) -> Partition:
+    """Parse a 1024-byte APA header."""
+    (
+        _, _, next_, prev, id_, _, _, start, length, type_, flags, nsub, _, main, number, _
+    ) = HEADER.unpack_from(header)
+    subs = tuple(
+        SUB_PARTITION.unpack_from(header, SUB_PARTITIONS_OFFSET + (i * SUB_PARTITION.size))
+        for i in range(min(nsub, MAX_SUB_PARTITIONS))
+    )
+    return Partition(
+        next=next_,
+        prev=prev,
+        id=id_.split(b"\0", 1)[0].decode("ascii", "replace"),
+        start=start,
+        length=length,
+        type=type_,
+        flags=flags,
+        main=main,
+        number=number,
+        subs=subs
+    )
+
+
+def pack_header(partition: Partition, header: bytes) -> bytes:
+    """
+    Write a Partition's fields over an existing 1024-byte APA header and recalculate the checksum.
+
+    Fields not represented by Partition, like passwords, creation time, and
+    the MBR data, are kept from the existing header.
+    """
+    header = bytearray(header)
+    struct.pack_into("<II32s", header, 8, partition.next, partition.prev, partition.id.encode("ascii"))
+    struct.pack_into(
+        "<IIHHI", header, 64,
+        partition.start, partition.length, partition.type, partition.flags, len(partition.subs)
+    )
+    struct.pack_into("<II", header, 88, partition.main, partition.number)
+    header[SUB_PARTITIONS_OFFSET:HEADER_SIZE] = bytes(HEADER_SIZE - SUB_PARTITIONS_OFFSET)
+    for i, sub in enumerate(partition.subs):
+        SUB_PARTITION.pack_into(header, SUB_PARTITIONS_OFFSET + (i * SUB_PARTITION.size), *sub)
+    header[0:4] = checksum(header)
+    return bytes(header)
+
+
+def link(partitions: list[Partition]) -> list[Partition]:
+    """Sort partitions by their start and link each to its neighbors, making a circular partition list."""
+    partitions = sorted(partitions, key=lambda p: p.start)
+    return [
+        partition._replace(
+            next=partitions[(i + 1) % len(partitions)].start,
+            prev=partitions[i - 1].start
+        )
+        for i, partition in enumerate(partitions)
+    ]
+
+
+def empty_partition(offset: int, size: int) -> Partition:
+    """Create an empty (unused) partition, as free space within the partition list is kept in them."""
+    return Partition(
+        next=0, prev=0, id="", start=offset // SECTOR_SIZE, length=size // SECTOR_SIZE,
+        type=0, flags=0, main=0, number=0, subs=()
+    )
+
+
+def read_header(target, sector: int) -> bytes:
+    """Read the 1024-byte APA header at a sector of an HDD or image target."""
+    target.seek(sector * SECTOR_SIZE)
+    return target.read(HEADER_SIZE)
+
+
+def read_partitions(target) -> list[Partition]:
+    """
+    Walk the APA partition list of an HDD or image target, starting from the MBR partition at sector 0.
+
+    Sub-partitions have their own header in the list with `main` set to the
+    start sector of the main partition they extend.
+    """
+    partitions = []
+    seen = set()
+    sector = 0
+    while sector not in seen:
+        seen.add(sector)
+        header = read_header(target, sector)
+        if not is_valid(header):
+            raise ValueError(f"Invalid APA header at sector {sector}, the partition list is broken")
+        partition = parse_header(header)
+        if partition.start != sector:
+            raise ValueError(f"APA header at sector {sector} claims to start at sector {partition.start}")
+        partitions.append(partition)
+        sector = partition.next
+    return partitions
@@ -0,0 +1,334 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import stat
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+# GUI responsiveness benchmark, driving the Main window on Qt's offscreen platform against synthetic
+# drives and a stand-in hdl-dump. Run it with `python -m hdlg.bench`. The stand-in is this module too,
+# so Qt and the UI are only imported by the harness to keep every stand-in hdl-dump call quick to start.
+
+GAMES = 500
+DRIVES = 4
+INSTALLS = 3
+DRIVE_SIZE = 8 * 1024 * 1024 * 1024
+TICK_INTERVAL = 1  # ms
+TIMEOUT = 120.0
+
+
+def stand_in(args: list[str]) -> int:
+    """
+    A stand-in hdl-dump with synthetic output for the commands hdlg uses.
+
+    It's configured by the environment as hdlg starts it, with the number
+    of installed games, the delay of each query, and the duration and
+    progress lines per second of each install.
+    """
+    games = int(os.environ.get("HDLG_BENCH_GAMES", GAMES))
+    delay = float(os.environ.get("HDLG_BENCH_DELAY", "0.1"))
+    install_time = float(os.environ.get("HDLG_BENCH_INSTALL_TIME", "2"))
+    lines_per_second = float(os.environ.get("HDLG_BENCH_LINES_PER_SECOND", "100"))
+
+    command = args[0] if args else ""
+    if command == "map":
+        time.sleep(delay)
+        used = games * 4000
+        total = used * 2 or 1
+        print(f"Total slice size: {total}MB, used: {used}MB, available: {total - used}MB")
+    elif command == "hdl_toc":
+        time.sleep(delay)
+        print("type   size flags dma startup     name")
+        for i in range(games):
+            print(f"DVD  4000000KB  0  *u4  SLUS_{i // 100:03d}.{i % 100:02d}  Synthetic Game {i:04d}")
+        print(f"total {games * 4000}MB, used {games * 4000}MB, available 0MB")
+    elif command == "cdvd_info2":
+        time.sleep(delay)
+        print('DVD 4000000KB "SYNTHETIC" "SLUS_999.99"')
+    elif command.startswith("inject_"):
+        lines = max(1, int(install_time * lines_per_second))
+        for i in range(1, lines + 1):
+            time.sleep(install_time / lines)
+            remaining = max(0.0, install_time - install_time * i / lines)
+            print(f"{i / lines * 100:.1f}%, {remaining:.0f}s remaining, 30.00 MB/sec", flush=True)
+    else:
+        print(f"Unrecognized command {command!r}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def make_stand_in(directory: Path) -> Path:
+    """
+    Create an executable that runs the stand-in hdl-dump, as hdlg calls hdl-dump by path.
+
+    It runs this module with this Python, wherever hdlg is run from.
+    """
+    root = Path(__file__).resolve().parent.parent
+    if os.name == "nt":
+        path = directory / "hdl-dump.cmd"
+        path.write_text(
+            f'@set "PYTHONPATH={root};%PYTHONPATH%"\r\n'
+            f'@"{sys.executable}" -m hdlg.bench --stand-in %*\r\n',
+            "utf8"
+        )
+    else:
+        path = directory / "hdl-dump"
+        path.write_text(
+            f'#!/bin/sh\n'
+            f'PYTHONPATH="{root}${{PYTHONPATH:+:$PYTHONPATH}}" exec "{sys.executable}" -m hdlg.bench --stand-in "$@"\n',
+            "utf8"
+        )
+        path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return path
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def benchmark(games: int = GAMES, drives: int = DRIVES, installs: int = INSTALLS) -> dict[str, dict[str, float]]:
+    """
+    Measure the responsiveness of the Main window while refreshing the HDD list, loading an HDD, and installing.
+
+    A precise timer ticks on the UI thread every millisecond, so the gaps
+    between ticks are how long the event loop was blocked. Also measured are
+    the time to the first row and to the full list, which is the HDD list
+    when refreshing, the games list when loading, and for a batch install
+    the first progress update and the games list after the last install.
+    A loaded games list is inserted all at once, so loading's first row is
+    as late as its full list until the list is filled in incrementally.
+    Returns the results of each scenario in milliseconds.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.environ["HDLG_BENCH_GAMES"] = str(games)
+
+    from PySide2 import QtCore, QtWidgets
+    from PySide2.QtWidgets import QApplication
+
+    from hdlg import utils
+    from hdlg.config import Directories, config
+    from hdlg.hdd import HDD
+    from hdlg.image import HDDImage
+    from hdlg.ui.main import Main
+    from hdlg.ui.worker import MainWorker
+
+    class SyntheticHDD(HDDImage):
+        """A formatted sparse image that's queried with hdl-dump like an HDD."""
+        disk_map = HDD.disk_map
+        load_info = HDD.load_info
+        get_games_list = HDD.get_games_list
+        edit = HDD.edit
+        parse_disk_map = HDD.parse_disk_map
+        parse_games_list = HDD.parse_games_list
+
+        def __init__(self, target: Path, model: str):
+            super().__init__(target, model, create_size=DRIVE_SIZE)
+            self._disk_map = None
+            self.format()
+
+    workspace = Path(tempfile.mkdtemp(prefix="hdlg-bench-"))
+    utils.HDL_DUMP_BIN = str(make_stand_in(workspace))
+    hdds = [SyntheticHDD(workspace / f"drive{i}.img", f"Synthetic Drive {i}") for i in range(drives)]
+    isos = []
+    for i in range(installs):
+        iso = workspace / f"Synthetic Game {i}.iso"
+        iso.write_bytes(bytes(2048))
+        isos.append(iso)
+
+    # measure the UI itself, without the user's optional features or their dialogs
+    config.verify, config.remote, config.library, config.staging = {}, {}, {}, {}
+
+    def find_hdds(worker: MainWorker) -> None:
+        for hdd in hdds:
+            worker.found_device.emit(hdd)
+        worker.finished.emit()
+
+    MainWorker.find_hdds = find_hdds
+    Main.order_games = lambda self, filenames, as_selected, optimized: filenames
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    app.setStyle("fusion")
+    app.setStyleSheet((Directories.root / "ui" / "app.qss").read_text("utf8"))
+
+    results = {}
+
+    def measure(
+        start: Callable[[], None],
+        first_row: Callable[[], bool],
+        full_list: Callable[[], bool],
+        done: Callable[[], bool]
+    ) -> dict[str, float]:
+        loop = QtCore.QEventLoop()
+        timer = QtCore.QTimer()
+        timer.setTimerType(QtCore.Qt.PreciseTimer)
+        timer.setInterval(TICK_INTERVAL)
+        gaps, marks = [], {}
+        started = last = time.perf_counter()
+
+        def tick():
+            nonlocal last
+            now = time.perf_counter()
+            gaps.append((now - last) * 1000)
+            last = now
+            for name, check in (("first_row", first_row), ("full_list", full_list)):
+                if name not in marks and check():
+                    marks[name] = (now - started) * 1000
+            if ("full_list" in marks and done()) or now - started > TIMEOUT:
+                loop.quit()
+
+        timer.timeout.connect(tick)
+        timer.start()
+        QtCore.QTimer.singleShot(0, start)
+        loop.exec_()
+        timer.stop()
+
+        return {
+            "duration": (time.perf_counter() - started) * 1000,
+            "gap_max": max(gaps, default=0.0),
+            "gap_p99": percentile(gaps, 99),
+            "ticks": len(gaps),
+            "first_row": marks.get("first_row", -1),
+            "full_list": marks.get("full_list", -1)
+        }
+
+    def hdd_buttons() -> int:
+        return sum(isinstance(x, QtWidgets.QPushButton) for x in main.window.deviceListDevices_2.children())
+
+    def games_rows() -> int:
+        for i in range(main.window.hddInfoList.topLevelItemCount()):
+            item = main.window.hddInfoList.topLevelItem(i)
+            if item.text(0) == "Games":
+                return item.childCount()
+        return 0
+
+    def idle() -> bool:
+        return main.window.deviceListDevices_2.isEnabled() and main.window.refreshIcon.isEnabled()
+
+    try:
+        main = Main()  # refreshes the HDD list on its own
+        main.show()
+        measure(lambda: None, lambda: True, lambda: hdd_buttons() == drives, idle)
+
+        results["refresh"] = measure(
+            main.refresh_hdd_list,
+            lambda: hdd_buttons() > 0,
+            lambda: hdd_buttons() == drives,
+            idle
+        )
+        results["load"] = measure(
+            lambda: main.load_hdd(hdds[0]),
+            lambda: games_rows() > 0,
+            lambda: games_rows() == games,
+            idle
+        )
+
+        loads = []
+        load_hdd = main.load_hdd
+        main.window.progressBar.setValue(0)
+        main.load_hdd = lambda hdd: (loads.append(hdd), load_hdd(hdd))
+        results["install"] = measure(
+            lambda: main.install_games(hdds[0], isos),
+            lambda: main.window.progressBar.value() > 0,
+            lambda: len(loads) == installs and games_rows() == games,
+            idle
+        )
+    finally:
+        for hdd in hdds:
+            hdd.dispose()
+
+    return results
+
+
+def check_budgets(results: dict[str, dict[str, float]], budgets: dict[str, dict[str, float]]) -> list[str]:
+    """Get every result that is over its budget, or wasn't reached at all."""
+    failures = []
+    for scenario, limits in budgets.items():
+        for name, limit in limits.items():
+            value = results.get(scenario, {}).get(name, -1)
+            if value < 0 or value > limit:
+                failures.append(f"{scenario} {name}: {value:.1f} ms (budget {limit} ms)")
+    return failures
+
+
+def record(results: dict[str, dict[str, float]], history: Path) -> Optional[dict]:
+    """Append results to the history file, returning the previous results to compare with."""
+    previous = None
+    if history.is_file():
+        lines = history.read_text("utf8").splitlines()
+        if lines:
+            previous = json.loads(lines[-1])
+    history.parent.mkdir(parents=True, exist_ok=True)
+    with history.open("a", encoding="utf8") as f:
+        f.write(json.dumps({"time": datetime.now().isoformat(timespec="seconds"), "results": results}) + "\n")
+    return previous
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--stand-in"]:
+        sys.exit(stand_in(sys.argv[2:]))
+
+    import argparse
+
+    from hdlg.config import Directories
+
+    parser = argparse.ArgumentParser(description="Benchmark the responsiveness of the hdlg GUI, offscreen.")
+    parser.add_argument("--games", type=int, default=GAMES, help="games installed on each synthetic drive")
+    parser.add_argument("--drives", type=int, default=DRIVES)
+    parser.add_argument("--installs", type=int, default=INSTALLS, help="games to install in the batch")
+    parser.add_argument(
+        "--budgets", type=Path,
+        help="JSON file of latency budgets in ms per scenario and result, to exit with an error when over any"
+    )
+    parser.add_argument("--history", type=Path, default=Directories.data / "bench" / "history.jsonl")
+    parser.add_argument(
+        "--make-stand-in", type=Path, metavar="DIR",
+        help="only write the stand-in hdl-dump to a folder, e.g., to put first on PATH to try remote HDDs offline"
+    )
+    args = parser.parse_args()
+
+    if args.make_stand_in:
+        args.make_stand_in.mkdir(parents=True, exist_ok=True)
+        print(make_stand_in(args.make_stand_in))
+        sys.exit(0)
+
+    results = benchmark(args.games, args.drives, args.installs)
+    previous = record(results, args.history)
+
+    for scenario, values in results.items():
+        print(scenario)
+        for name, value in values.items():
+            change = ""
+            if previous and name in previous["results"].get(scenario, {}):
+                change = f" ({value - previous['results'][scenario][name]:+.1f} since {previous['time']})"
+            print(f"  {name:>9}: {value:10.1f}{change}")
+
+    failures = check_budgets(results, json.loads(args.budgets.read_text("utf8"))) if args.budgets else []
+    for failure in failures:
+        print(f"Over budget: {failure}")
+    sys.exit(1 if failures else 0)
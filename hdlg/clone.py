@@ -0,0 +1,174 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterator, NamedTuple
+
+from hdlg import apa, formatter, plan
+
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+COPY_WORKERS = 4
+
+
+class Extent(NamedTuple):
+    """A byte range to copy from the source to the target, which differ when relocated."""
+    source: int
+    target: int
+    size: int
+
+
+def layout(partitions: list[apa.Partition], target_size: int) -> tuple[list[apa.Partition], list[Extent], bool]:
+    """
+    Plan where each partition goes on the target and which extents to copy.
+
+    Only allocated partitions are copied in full, empty partitions only need
+    their header to keep the partition list intact. If the layout doesn't
+    fit on the target, the allocated partitions are relocated, packed from
+    largest to smallest while keeping them aligned to their size. The old
+    empty partitions are dropped and the gaps left by the alignment become
+    new empty partitions instead, so the list still covers the disk
+    contiguously up to the free space at the end, like a formatted disk.
+
+    Returns the target's partition list, the extents, and if it's relocated.
+    When relocated, only the allocated partitions have an extent, the new
+    empty partitions have no source.
+    """
+    end = max(p.offset + p.size for p in partitions)
+    if end <= target_size:
+        extents = [
+            Extent(p.offset, p.offset, apa.HEADER_SIZE if p.is_empty else p.size)
+            for p in partitions
+        ]
+        return partitions, extents, False
+
+    mbr, used = partitions[0], [p for p in partitions[1:] if not p.is_empty]
+    allocator = plan.Allocator(plan.free_extents([mbr], target_size))
+    starts = {mbr.start: mbr.start}
+    for partition in sorted(used, key=lambda p: p.length, reverse=True):
+        if partition.length & (partition.length - 1):
+            raise ValueError(f"Partition {partition.id or partition.start} is not a power-of-two size")
+        offset = allocator.allocate(partition.size)
+        if offset is None:
+            raise ValueError(
+                f"The allocated partitions do not fit on the target, "
+                f"{partition.id or partition.start} could not be placed"
+            )
+        starts[partition.start] = offset // apa.SECTOR_SIZE
+
+    relocated = [
+        partition._replace(
+            start=starts[partition.start],
+            main=starts[partition.main] if partition.main in starts and partition.main else partition.main,
+            subs=tuple((starts[start], length) for start, length in partition.subs)
+        )
+        for partition in [mbr] + used
+    ]
+    end = max(p.offset + p.size for p in relocated)
+    new_partitions = apa.link(relocated + [apa.empty_partition(offset, size) for offset, size in allocator.gaps(end)])
+    extents = [Extent(p.offset, starts[p.start] * apa.SECTOR_SIZE, p.size) for p in [mbr] + used]
+    return new_partitions, extents, True
+
+
+def clone(
+    source,
+    target,
+    block_size: int = COPY_BLOCK_SIZE,
+    workers: int = COPY_WORKERS,
+    sparse: bool = False,
+    is_cancelled: Callable[[], bool] = lambda: False
+) -> Iterator[tuple[int, int]]:
+    """
+    Clone the allocated APA partitions of an HDD (or image) to another HDD (or image).
+
+    Blocks are copied by a pool of threads so reads from the source overlap
+    with writes to the target, with at most two blocks per thread in memory.
+    Set sparse when the target is a freshly created image, so blocks of
+    zeros are skipped and left as holes.
+
+    Yields the bytes copied so far and the total bytes to copy after every
+    block. The MBR header is held back until every block has been copied, so
+    a failed or cancelled clone never looks like a valid APA drive.
+    """
+    if block_size % apa.SECTOR_SIZE != 0:
+        raise ValueError("Block size must be a multiple of the sector size.")
+
+    partitions, extents, relocated = layout(source.partitions, target.disk_size)
+
+    blocks = [
+        (extent.source + x, extent.target + x, min(block_size, extent.size - x))
+        for extent in extents
+        for x in range(0, extent.size, block_size)
+    ]
+    total = sum(size for _, _, size in blocks)
+    done = 0
+    cancelled = False
+
+    source_lock = threading.Lock()
+    target_lock = threading.Lock()
+    zeros = bytes(block_size)
+
+    def copy_block(source_offset: int, target_offset: int, size: int) -> int:
+        with source_lock:
+            source.seek(source_offset)
+            data = source.read(size)
+        if target_offset == 0:
+            data = zeros[:apa.HEADER_SIZE] + data[apa.HEADER_SIZE:]
+        elif sparse and data == zeros[:size]:
+            return size
+        with target_lock:
+            target.seek(target_offset)
+            target.write(data)
+        return size
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        for block in blocks:
+            if is_cancelled():
+                cancelled = True
+                break
+            in_flight.add(pool.submit(copy_block, *block))
+            if len(in_flight) >= workers * 2:
+                completed, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    done += future.result()
+                    yield done, total
+        for future in in_flight:
+            done += future.result()
+            yield done, total
+
+    if cancelled:
+        return
+
+    # write the held back MBR header last, and when relocated, every header with its new location and links
+    sources = {extent.target: extent.source for extent in extents}
+    created = formatter.ps2_time()
+    for partition in reversed(partitions):
+        if not relocated and partition.offset != 0:
+            continue
+        if partition.offset in sources:
+            header = apa.read_header(source, sources[partition.offset] // apa.SECTOR_SIZE)
+            if relocated:
+                header = apa.pack_header(partition, header)
+        else:
+            header = formatter.new_header(partition, created)  # a gap left by relocating
+        target.seek(partition.offset)
+        target.write(header)
+    target.flush()
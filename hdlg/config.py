@@ -16,11 +16,46 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
+from __future__ import annotations
+
 from pathlib import Path
+from typing import Any
 
+import toml
 from appdirs import AppDirs
 
 
 class Directories:
     app_dirs = AppDirs("hdlg", False)
     root = Path(__file__).resolve().parent  # root of package/src
+    config = Path(app_dirs.user_config_dir)
+    cache = Path(app_dirs.user_cache_dir)
+    data = Path(app_dirs.user_data_dir)
+
+
+class Config:
+    """
+    User configuration loaded from `config.toml` in the user config directory.
+
+    Every section is optional, a missing file or section leaves the feature
+    it configures disabled or at its default.
+    """
+
+    path = Directories.config / "config.toml"
+
+    def __init__(self, **kwargs: Any):
+        self.verify: dict = kwargs.get("verify") or {}
+        self.remote: dict = kwargs.get("remote") or {}
+        self.library: dict = kwargs.get("library") or {}
+        self.hdl_dump: dict = kwargs.get("hdl_dump") or {}
+        self.staging: dict = kwargs.get("staging") or {}
+
+    @classmethod
+    def load(cls, path: Path = None) -> Config:
+        path = path or cls.path
+        if not path.is_file():
+            return cls()
+        return cls(**toml.load(path))
+
+
+config = Config.load()
@@ -0,0 +1,245 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import struct
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from hdlg import apa
+from hdlg.config import Directories
+from hdlg.scan import fingerprint
+
+HDL_GAME_PARTITION_TYPE = 0x1337
+# the HDL game header (OPL's hdl_apa_header), 1 MB + 4 KB into a game's main partition
+HDL_HEADER_OFFSET = 0x101000
+HDL_HEADER_SIZE = 1024
+HDL_MAGIC = 0xDEADFEED
+HDL_NAME = slice(0x008, 0x0A8)
+HDL_COMPAT_FLAGS = 0x0A8
+HDL_DMA_TYPE = 0x0AA
+HDL_DMA_MODE = 0x0AB
+HDL_STARTUP = slice(0x0AC, 0x0E8)
+DMA_TYPES = {"m": 0x20, "u": 0x40}  # Multi-word DMA, Ultra DMA
+DMA = re.compile(r"^\*?([mu])([0-7])$", re.IGNORECASE)
+
+
+def parse_dma(dma: str) -> tuple[int, int]:
+    """Parse a DMA mode as shown by hdl-dump, e.g., `*u4` for UDMA 4, to its DMA type and mode."""
+    match = DMA.match(dma.strip())
+    if not match:
+        raise ValueError(f"Invalid DMA mode {dma!r}, expected e.g. *m2 or *u4")
+    return DMA_TYPES[match.group(1).lower()], int(match.group(2))
+
+
+def is_hdl_header(header: bytes) -> bool:
+    return HDL_MAGIC in struct.unpack_from("<II", header)
+
+
+def coalesce(writes: dict[int, bytes]) -> list[tuple[int, bytes]]:
+    """Sort writes by offset and merge those that are back to back into single writes."""
+    runs: list[tuple[int, bytearray]] = []
+    for offset in sorted(writes):
+        if runs and runs[-1][0] + len(runs[-1][1]) == offset:
+            runs[-1][1].extend(writes[offset])
+        else:
+            runs.append((offset, bytearray(writes[offset])))
+    return [(offset, bytes(data)) for offset, data in runs]
+
+
+class EditSession:
+    """
+    Stage edits to many installed games and commit them all in one write pass.
+
+    Edits are only recorded in memory until commit(), which reads every HDL
+    game header once in disk order, applies the edits, then writes the
+    changed headers in one sorted and coalesced pass. A copy of the original
+    headers is saved first, and restored if any write fails, so the HDD never
+    ends up with only some of the edits.
+
+    It can be used as a context manager that commits on exit, unless an
+    exception was raised.
+    """
+
+    def __init__(self, hdd):
+        self.hdd = hdd
+        self.edits: dict[str, dict[str, Any]] = {}
+
+    def __enter__(self) -> EditSession:
+        return self
+
+    def __exit__(self, exc_type, *_, **__):
+        if exc_type is None:
+            self.commit()
+
+    def __len__(self) -> int:
+        return len(self.edits)
+
+    def rename(self, game_id: str, name: str) -> None:
+        encoded = name.encode("utf8")
+        if not encoded or len(encoded) >= HDL_NAME.stop - HDL_NAME.start:
+            raise ValueError(f"Game Name must be 1 to {HDL_NAME.stop - HDL_NAME.start - 1} bytes long")
+        self.edits.setdefault(game_id, {})["name"] = encoded
+
+    def set_flags(self, game_id: str, flags: int) -> None:
+        if not 0 <= flags <= 0xFF:
+            raise ValueError("Compatibility flags must be within 0-255")
+        self.edits.setdefault(game_id, {})["flags"] = flags
+
+    def set_dma(self, game_id: str, dma: str) -> None:
+        self.edits.setdefault(game_id, {})["dma"] = parse_dma(dma)
+
+    def discard(self) -> None:
+        self.edits.clear()
+
+    def read_headers(self) -> dict[str, list[tuple[int, bytes]]]:
+        """
+        Read every HDL game header in disk order, mapped by Game ID to their offsets and data.
+
+        The partition list is read fresh rather than from the HDD's cache, so
+        Games installed since it was cached are found too. A Game ID installed
+        more than once maps to every copy.
+        """
+        headers: dict[str, list[tuple[int, bytes]]] = {}
+        for partition in sorted(apa.read_partitions(self.hdd), key=lambda p: p.start):
+            if partition.type != HDL_GAME_PARTITION_TYPE or partition.main:
+                continue  # not a game, or a sub-partition of one
+            offset = partition.offset + HDL_HEADER_OFFSET
+            self.hdd.seek(offset)
+            header = self.hdd.read(HDL_HEADER_SIZE)
+            if is_hdl_header(header):
+                game_id = header[HDL_STARTUP].split(b"\0", 1)[0].decode("ascii", "replace")
+                headers.setdefault(game_id, []).append((offset, header))
+        return headers
+
+    @staticmethod
+    def apply(header: bytes, edits: dict[str, Any]) -> bytes:
+        header = bytearray(header)
+        if "name" in edits:
+            header[HDL_NAME] = edits["name"].ljust(HDL_NAME.stop - HDL_NAME.start, b"\0")
+        if "flags" in edits:
+            header[HDL_COMPAT_FLAGS] = edits["flags"]
+        if "dma" in edits:
+            header[HDL_DMA_TYPE], header[HDL_DMA_MODE] = edits["dma"]
+        return bytes(header)
+
+    def commit(self) -> Optional[Path]:
+        """
+        Write all staged edits to the HDD in one pass.
+
+        Returns the path of the rollback copy of the original headers, or None
+        if there was nothing to change.
+        """
+        if not self.edits:
+            return None
+
+        headers = self.read_headers()
+        missing = set(self.edits) - set(headers)
+        if missing:
+            raise ValueError(f"Games not found on the HDD: {', '.join(sorted(missing))}")
+        duplicates = {game_id for game_id in self.edits if len(headers[game_id]) > 1}
+        if duplicates:
+            raise ValueError(
+                f"Games installed more than once, so which copy to edit is unclear: {', '.join(sorted(duplicates))}"
+            )
+
+        originals, changes = {}, {}
+        for game_id, edits in self.edits.items():
+            (offset, header), = headers[game_id]
+            new_header = self.apply(header, edits)
+            if new_header != header:
+                originals[offset] = header
+                changes[offset] = new_header
+        if not changes:
+            self.edits.clear()
+            return None
+
+        rollback_path = save_rollback(self.hdd, originals)
+
+        try:
+            for offset, data in coalesce(changes):
+                self.hdd.seek(offset)
+                self.hdd.write(data)
+            self.hdd.flush()
+        except Exception:
+            restore(self.hdd, originals)
+            raise
+
+        self.edits.clear()
+        return rollback_path
+
+
+def rollback_directory() -> Path:
+    return Directories.data / "rollback"
+
+
+def save_rollback(hdd, originals: dict[int, bytes]) -> Path:
+    """
+    Save a copy of the original headers that are about to be overwritten.
+
+    The drive is identified like a scan history, by its model, size, and the
+    time it was formatted, see hdlg.scan.fingerprint. Unlike the checksum of
+    the __mbr partition, it doesn't change with every install.
+    """
+    path = rollback_directory() / f"{datetime.now():%Y%m%d-%H%M%S-%f}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({
+        "target": hdd.target,
+        "model": hdd.model,
+        "drive": fingerprint(hdd),
+        "headers": {str(offset): data.hex() for offset, data in originals.items()}
+    }, indent=2), "utf8")
+    return path
+
+
+def restore(hdd, originals: dict[int, bytes]) -> None:
+    """Write back original headers, in one sorted and coalesced pass."""
+    for offset, data in coalesce(originals):
+        hdd.seek(offset)
+        hdd.write(data)
+    hdd.flush()
+
+
+def rollback(hdd, path: Path) -> int:
+    """
+    Undo a committed edit session using its rollback copy, returning the number of Games restored.
+
+    Every header is checked to still be the HDL header of the same Game, in
+    a Game partition of the current partition list, before anything is
+    written, as the Game may have been deleted and its space reused since.
+    """
+    saved = json.loads(path.read_text("utf8"))
+    if saved.get("drive") != fingerprint(hdd):
+        raise ValueError("The rollback copy is of a different HDD, or the HDD has been re-formatted since")
+    originals = {int(offset): bytes.fromhex(data) for offset, data in saved["headers"].items()}
+    games = {
+        partition.offset + HDL_HEADER_OFFSET
+        for partition in apa.read_partitions(hdd)
+        if partition.type == HDL_GAME_PARTITION_TYPE and not partition.main
+    }
+    for offset, data in sorted(originals.items()):
+        hdd.seek(offset)
+        current = hdd.read(HDL_HEADER_SIZE)
+        if offset not in games or not is_hdl_header(current) or current[HDL_STARTUP] != data[HDL_STARTUP]:
+            raise ValueError(f"The Game at offset {offset} is no longer the one in the rollback copy")
+    restore(hdd, originals)
+    return len(originals)
@@ -0,0 +1,176 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import struct
+from datetime import datetime, timedelta, timezone
+
+from hdlg import apa, metrics, plan
+
+APA_TYPE_MBR = 0x0001
+APA_TYPE_PFS = 0x0100
+MBR_MAGIC = b"Sony Computer Entertainment Inc."
+MBR_VERSION = 2
+MBR_OFFSET = 256  # the MBR data within the __mbr partition's header
+CREATED_OFFSET = 80
+MBR_SIZE = 128 * 1024 * 1024
+# the system partitions the PS2 browser and HDD utility discs create when formatting
+SYSTEM_PARTITIONS = [
+    ("__net", 128 * 1024 * 1024),
+    ("__system", 256 * 1024 * 1024),
+    ("__sysconf", 128 * 1024 * 1024),
+    ("__common", 1024 * 1024 * 1024),
+]
+PS2_TIMEZONE = timezone(timedelta(hours=9))  # the PS2 keeps its clock in JST
+
+
+def ps2_time(time: datetime = None) -> bytes:
+    """Pack a time as the PS2's 8-byte time (unused, second, minute, hour, day, month, year)."""
+    time = (time or datetime.now(timezone.utc)).astimezone(PS2_TIMEZONE)
+    return struct.pack("<xBBBBBH", time.second, time.minute, time.hour, time.day, time.month, time.year)
+
+
+def layout(disk_size: int) -> list[apa.Partition]:
+    """
+    Lay out the __mbr and system partitions of a freshly formatted disk.
+
+    Partitions are placed with the same buddy allocation as installs, so
+    each is aligned to its size, but as close to the start as possible, as
+    the __mbr partition must be at sector 0. Any gaps left by the alignment
+    become empty partitions so the partition list covers the disk
+    contiguously. Everything after the last partition is left as free space.
+    """
+    allocator = plan.Allocator(plan.free_extents([], disk_size))
+    placed = []
+    for id_, size in [("__mbr", MBR_SIZE)] + SYSTEM_PARTITIONS:
+        offset = allocator.allocate(size, lowest=True)
+        if offset is None:
+            raise ValueError(f"The disk is too small to be formatted for the PS2, {id_} does not fit")
+        placed.append((offset, size, id_, APA_TYPE_MBR if id_ == "__mbr" else APA_TYPE_PFS))
+    end = max(offset + size for offset, size, _, _ in placed)
+
+    return apa.link([
+        apa.empty_partition(offset, size)._replace(id=id_, type=type_)
+        for offset, size, id_, type_ in placed
+    ] + [
+        apa.empty_partition(offset, size)
+        for offset, size in allocator.gaps(end)
+    ])
+
+
+def new_header(partition: apa.Partition, created: bytes) -> bytes:
+    """Create a 1024-byte APA header for a partition, with the MBR data if it's the __mbr partition."""
+    header = bytearray(apa.HEADER_SIZE)
+    header[4:8] = apa.APA_MAGIC
+    header[CREATED_OFFSET:CREATED_OFFSET + 8] = created
+    if partition.type == APA_TYPE_MBR:
+        # magic, version, nsector, created, osd start, osd size
+        struct.pack_into("<32sII8sII", header, MBR_OFFSET, MBR_MAGIC, MBR_VERSION, 0, created, 0, 0)
+    return apa.pack_header(partition, header)
+
+
+def format_apa(target, discard: bool = False) -> list[apa.Partition]:
+    """
+    Format an HDD (or image) for the PS2 by writing a new APA partition list.
+
+    Only the partition headers are written, so it takes the same time no
+    matter the size of the disk. The rest of the disk isn't zeroed, old data
+    is unreachable once the partition list no longer links to it. With
+    discard, the whole disk is first discarded (TRIM, or hole punching on
+    an image) if the target supports it.
+
+    The old MBR header is cleared first and the new one written last, so an
+    interrupted format never looks like a valid APA drive. Returns the new
+    partition list.
+    """
+    partitions = layout(target.disk_size)
+    created = ps2_time()
+
+    with metrics.span("format.apa"):
+        target.seek(0)
+        target.write(bytes(apa.HEADER_SIZE))
+        target.flush()
+        if discard and not target.discard(0, target.disk_size):
+            metrics.count("format.discard_unsupported")
+        for partition in reversed(partitions):
+            target.seek(partition.offset)
+            target.write(new_header(partition, created))
+        target.flush()
+
+    return partitions
+
+
+def validate(target) -> list[apa.Partition]:
+    """
+    Check a formatted HDD (or image) with the native reader, raising a ValueError if it isn't a valid APA drive.
+
+    Every header must be valid and linked into the list, and the partitions
+    must cover the disk contiguously up to the free space at the end, as
+    hdl-dump and the PS2 expect. Returns the partition list.
+    """
+    partitions = apa.read_partitions(target)
+    if partitions[0].id != "__mbr" or partitions[0].type != APA_TYPE_MBR:
+        raise ValueError("The first partition is not the __mbr partition")
+    offset = 0
+    for partition in sorted(partitions, key=lambda p: p.start):
+        if partition.offset != offset:
+            raise ValueError(f"The partition list has a gap or overlap at sector {offset // apa.SECTOR_SIZE}")
+        offset += partition.size
+    if offset > target.disk_size:
+        raise ValueError("The partition list runs past the end of the disk")
+    missing = {x for x, _ in SYSTEM_PARTITIONS} - {p.id for p in partitions}
+    if missing:
+        raise ValueError(f"The system partitions {', '.join(sorted(missing))} are missing")
+    return partitions
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import tempfile
+    import time
+    from pathlib import Path
+
+    from hdlg.image import HDDImage
+
+    parser = argparse.ArgumentParser(
+        description="Format sparse images of each size and check them with the native APA reader."
+    )
+    parser.add_argument("sizes", nargs="*", type=float, default=[8, 120, 500, 2000], help="disk sizes in GB")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="hdlg-format-") as directory:
+        for size in args.sizes:
+            disk_size = int(size * 1000 ** 3) // apa.SECTOR_SIZE * apa.SECTOR_SIZE
+            with HDDImage(Path(directory, f"{size:g}GB.img"), create_size=disk_size) as image:
+                start = time.perf_counter()
+                try:
+                    written = image.format()
+                    elapsed = time.perf_counter() - start
+                    read = validate(image)
+                    if read != written:
+                        raise ValueError("The partition list read back differs from the one written")
+                except ValueError as e:
+                    print(f"{size:g} GB: FAILED, {e}")
+                    failed = True
+                else:
+                    print(f"{size:g} GB: {len(read)} partitions written and read back in {elapsed * 1000:.1f} ms")
+            Path(directory, f"{size:g}GB.img").unlink()
+    sys.exit(1 if failed else 0)
@@ -18,19 +18,69 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
 
+import ctypes
+import re
 import struct
-from ctypes.wintypes import HANDLE
+import subprocess
+import time
+from contextlib import contextmanager
+from ctypes.wintypes import DWORD, HANDLE
 from pathlib import Path
-from typing import Union
+from typing import Iterator, Union
 
+import pywintypes
 import win32con
 import win32file
 import winioctlcon
 
-from hdlg.utils import NEIGHBORING_WHITESPACE, hdl_dump
+from hdlg import apa, formatter, metrics
+from hdlg.edit import EditSession
+from hdlg.utils import NEIGHBORING_WHITESPACE, hdl_dump_many
+
+IOCTL_STORAGE_MANAGE_DATA_SET_ATTRIBUTES = 0x2D9404
+DEVICE_DSM_ACTION_TRIM = 1
+DEVICE_DSM_FLAG_TRIM_NOT_FS_ALLOCATED = 0x80000000
+# size, action, flags, parameter block offset & length, data set ranges offset & length
+DEVICE_MANAGE_DATA_SET_ATTRIBUTES = struct.Struct("<IIIIIII4x")
+DEVICE_DATA_SET_RANGE = struct.Struct("<qQ")
+MAX_TRIM_RANGE = 1024 * 1024 * 1024
+# number of extents, then disk number, starting offset, and length of each extent
+VOLUME_DISK_EXTENTS = struct.Struct("<I4x")
+DISK_EXTENT = struct.Struct("<I4xqq")
+MAX_VOLUME_EXTENTS = 32
+REMOTE_TIMEOUT = 30.0
+REMOTE_CONNECT_TIMEOUT = 5.0
+REMOTE_RETRIES = 3
+# hdl-dump prints the OS's socket error when it can't reach or loses the console, e.g., Winsock's messages
+CONNECTION_ERROR = re.compile(
+    rb"connect|refused|unreachable|no route|timed out|did not properly respond|forcibly closed|reset by peer",
+    re.IGNORECASE
+)
+
+
+def volume_names() -> Iterator[str]:
+    """Get the GUID path (\\\\?\\Volume{...}\\) of every volume on the system, with or without a drive letter."""
+    kernel32 = ctypes.windll.kernel32
+    kernel32.FindFirstVolumeW.restype = HANDLE
+    kernel32.FindNextVolumeW.argtypes = [HANDLE, ctypes.c_wchar_p, DWORD]
+    kernel32.FindVolumeClose.argtypes = [HANDLE]
+    buffer = ctypes.create_unicode_buffer(1024)
+    find = kernel32.FindFirstVolumeW(buffer, len(buffer))
+    if find is None or find == HANDLE(-1).value:
+        return
+    try:
+        while True:
+            yield buffer.value
+            if not kernel32.FindNextVolumeW(find, buffer, len(buffer)):
+                return
+    finally:
+        kernel32.FindVolumeClose(find)
 
 
 class HDD:
+    # whether hdlg can read and write the HDD's sectors itself, and not only through hdl-dump
+    direct_access = True
+
     def __init__(self, target: Union[str, Path], model: str):
         self.handle = win32file.INVALID_HANDLE_VALUE
         self.target = target
@@ -42,6 +92,7 @@ class HDD:
         self._disk_map = None
         self._is_apa_partitioned = None
         self._apa_checksum = None
+        self._partitions = None
 
         self.open(target)
 
@@ -77,20 +128,155 @@ class HDD:
 
     def seek(self, to: int, whence: int = win32file.FILE_BEGIN) -> int:
         pos = win32file.SetFilePointer(self.handle, to, whence)
-        if pos != to:
+        if whence == win32file.FILE_BEGIN and pos != to:
             raise IOError(f"Seek was not precise...")
         return pos
 
+    def tell(self) -> int:
+        return self.seek(0, whence=win32file.FILE_CURRENT)
+
     def read(self, size: int) -> bytes:
         if size % 512 != 0:
             raise ValueError("Size must be a multiple of 512 for some reason, Ask Windows.")
-        res, data = win32file.ReadFile(self.handle, size, None)
+        with metrics.span("hdd.read"):
+            try:
+                res, data = win32file.ReadFile(self.handle, size, None)
+            except pywintypes.error as e:
+                # e.g., a bad sector, raised as an IOError like any other read error
+                raise IOError(f"An error occurred: {e.winerror} {e.strerror}") from e
+        metrics.count("hdd.bytes_read", len(data))
         if res != 0:
             raise IOError(f"An error occurred: {res} {data}")
         if len(data) < size:
             raise IOError(f"Read {size - len(data)} less bytes than requested...")
         return data
 
+    def write(self, data: bytes) -> int:
+        if len(data) % 512 != 0:
+            raise ValueError("Size must be a multiple of 512 for some reason, Ask Windows.")
+        with metrics.span("hdd.write"):
+            try:
+                res, written = win32file.WriteFile(self.handle, data, None)
+            except pywintypes.error as e:
+                raise IOError(f"An error occurred: {e.winerror} {e.strerror}") from e
+        metrics.count("hdd.bytes_written", written)
+        if res != 0:
+            raise IOError(f"An error occurred: {res}")
+        if written < len(data):
+            raise IOError(f"Wrote {len(data) - written} less bytes than requested...")
+        return written
+
+    def flush(self) -> None:
+        win32file.FlushFileBuffers(self.handle)
+
+    def discard(self, offset: int, size: int) -> bool:
+        """
+        TRIM a byte range of the HDD, telling the drive its data is no longer needed.
+
+        Returns False if the drive doesn't support TRIM, e.g., spinning HDDs.
+        """
+        ranges = b"".join(
+            DEVICE_DATA_SET_RANGE.pack(x, min(MAX_TRIM_RANGE, offset + size - x))
+            for x in range(offset, offset + size, MAX_TRIM_RANGE)
+        )
+        request = DEVICE_MANAGE_DATA_SET_ATTRIBUTES.pack(
+            DEVICE_MANAGE_DATA_SET_ATTRIBUTES.size - 4,  # without the padding to align the ranges
+            DEVICE_DSM_ACTION_TRIM,
+            DEVICE_DSM_FLAG_TRIM_NOT_FS_ALLOCATED,
+            0, 0,
+            DEVICE_MANAGE_DATA_SET_ATTRIBUTES.size, len(ranges)
+        )
+        try:
+            with metrics.span("hdd.discard"):
+                win32file.DeviceIoControl(self.handle, IOCTL_STORAGE_MANAGE_DATA_SET_ATTRIBUTES, request + ranges, None)
+        except pywintypes.error:
+            return False
+        return True
+
+    @property
+    def disk_number(self) -> int:
+        """Get the HDD's disk number, the N of \\\\.\\PHYSICALDRIVEN."""
+        device_type, number, partition = struct.unpack("<III", win32file.DeviceIoControl(
+            self.handle, winioctlcon.IOCTL_STORAGE_GET_DEVICE_NUMBER, None, 12
+        ))
+        return number
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """
+        Take the HDD from Windows to overwrite it, e.g., formatting or cloning to it.
+
+        Windows refuses raw writes within the extents of a mounted volume, so
+        every volume on the HDD is locked and dismounted, and kept locked until
+        done. Its drive layout (MBR or GPT) is deleted so nothing is mounted
+        from it again. Once done, Windows re-reads the HDD, which it now finds
+        to be raw (APA) with no volumes.
+        """
+        locked = []
+        try:
+            number = self.disk_number
+            for name in volume_names():
+                try:
+                    volume = win32file.CreateFile(
+                        name.rstrip("\\"),
+                        win32con.GENERIC_READ | win32con.GENERIC_WRITE,
+                        win32con.FILE_SHARE_READ | win32con.FILE_SHARE_WRITE,
+                        None,
+                        win32con.OPEN_EXISTING,
+                        0,
+                        None
+                    )
+                except pywintypes.error:
+                    continue  # e.g., an empty card reader
+                try:
+                    extents = win32file.DeviceIoControl(
+                        volume, winioctlcon.IOCTL_VOLUME_GET_VOLUME_DISK_EXTENTS, None,
+                        VOLUME_DISK_EXTENTS.size + DISK_EXTENT.size * MAX_VOLUME_EXTENTS
+                    )
+                except pywintypes.error:
+                    volume.Close()  # e.g., a CD-ROM drive
+                    continue
+                count, = VOLUME_DISK_EXTENTS.unpack_from(extents)
+                disks = {
+                    DISK_EXTENT.unpack_from(extents, VOLUME_DISK_EXTENTS.size + i * DISK_EXTENT.size)[0]
+                    for i in range(min(count, MAX_VOLUME_EXTENTS))
+                }
+                if number not in disks:
+                    volume.Close()
+                    continue
+                locked.append(volume)
+                try:
+                    win32file.DeviceIoControl(volume, winioctlcon.FSCTL_LOCK_VOLUME, None, None)
+                    win32file.DeviceIoControl(volume, winioctlcon.FSCTL_DISMOUNT_VOLUME, None, None)
+                except pywintypes.error as e:
+                    raise IOError(
+                        f"Unable to lock and dismount volume {name} on {self.target}, close anything using it: "
+                        f"{e.strerror}"
+                    ) from e
+            try:
+                win32file.DeviceIoControl(self.handle, winioctlcon.IOCTL_DISK_DELETE_DRIVE_LAYOUT, None, None)
+            except pywintypes.error:
+                pass  # it may already be raw, e.g., an APA formatted HDD
+            yield
+        finally:
+            try:
+                win32file.DeviceIoControl(self.handle, winioctlcon.IOCTL_DISK_UPDATE_PROPERTIES, None, None)
+            except pywintypes.error:
+                pass
+            for volume in locked:
+                volume.Close()
+
+    def format(self, discard: bool = False) -> list[apa.Partition]:
+        """Format the HDD for the PS2 with a new APA partition list, see hdlg.formatter."""
+        with self.exclusive():
+            partitions = formatter.format_apa(self, discard)
+        # everything cached about the old partition list is now stale
+        self._disk_map = None
+        self._is_apa_partitioned = None
+        self._apa_checksum = None
+        self._partitions = None
+        return partitions
+
     @property
     def geometry(self) -> tuple[int, ...]:
         """
@@ -132,21 +318,30 @@ class HDD:
         self._disk_size = (cyl_lo + cyl_hi) * tpc * spt * bps
         return self._disk_size
 
+    def query(self, *commands: str) -> list[list[str]]:
+        """Run hdl-dump commands against the HDD concurrently, returning their outputs in order."""
+        return hdl_dump_many([(x, self.hdl_target) for x in commands])
+
     @property
     def disk_map(self) -> tuple[int, ...]:
         """Get Total Slice Size, Used Space, and Available Space (in bytes)."""
         if self._disk_map is not None:
+            metrics.count("cache_hit.hdd.disk_map")
             return self._disk_map
+        metrics.count("cache_miss.hdd.disk_map")
+
+        self._disk_map = self.parse_disk_map(self.query("map")[0])
+
+        return self._disk_map
 
-        disk_map = hdl_dump("map", self.hdl_target)[-1]
+    @staticmethod
+    def parse_disk_map(lines: list[str]) -> tuple[int, ...]:
+        """Parse the Total Slice Size, Used Space, and Available Space from hdl-dump's map output."""
         total, used, available = [
             int(x.split(": ")[1][:-2]) * 1000 * 1000
-            for x in disk_map.split(", ")
+            for x in lines[-1].split(", ")
         ]
-
-        self._disk_map = (total, used, available)
-
-        return self._disk_map
+        return total, used, available
 
     @property
     def is_apa_partitioned(self) -> bool:
@@ -154,21 +349,13 @@ class HDD:
         if self._is_apa_partitioned is not None:
             return self._is_apa_partitioned
 
-        old_pos = self.seek(0, whence=win32file.FILE_CURRENT)
+        old_pos = self.tell()
 
         try:
             if self.seek(0) != 0:
                 raise RuntimeError("Unable to seek to start of HDD, cannot check if APA Partitioned...")
-            header = self.read(1024)
-            checksum = header[0:4]
-            magic = header[4:8]
-
-            new_checksum = struct.pack(
-                "<Q",
-                sum(struct.unpack("<I", header[n:n+4])[0] for n in range(4, 1024, 4))
-            )[:4]
-
-            self._is_apa_partitioned = magic == b"APA\0" and checksum == new_checksum
+            header = self.read(apa.HEADER_SIZE)
+            self._is_apa_partitioned = apa.is_valid(header)
         finally:
             self.seek(old_pos)
 
@@ -182,7 +369,7 @@ class HDD:
         if self._apa_checksum is not None:
             return self._apa_checksum
 
-        old_pos = self.seek(0, whence=win32file.FILE_CURRENT)
+        old_pos = self.tell()
 
         try:
             if self.seek(0) != 0:
@@ -194,6 +381,27 @@ class HDD:
 
         return self._apa_checksum
 
+    @property
+    def partitions(self) -> list[apa.Partition]:
+        """Get the APA partition list by reading the partition headers directly."""
+        if self._partitions is not None:
+            metrics.count("cache_hit.hdd.partitions")
+            return self._partitions
+        metrics.count("cache_miss.hdd.partitions")
+
+        old_pos = self.tell()
+
+        try:
+            self._partitions = apa.read_partitions(self)
+        finally:
+            self.seek(old_pos)
+
+        return self._partitions
+
+    def edit(self) -> EditSession:
+        """Start a session to stage edits to installed games, and commit them all in one write pass."""
+        return EditSession(self)
+
     def get_games_list(self) -> list[tuple[str, int, int, str, str, str]]:
         """
         Get a list of games installed on the HDD (if any).
@@ -206,8 +414,28 @@ class HDD:
             GameID
             GameName
         """
+        return self.parse_games_list(self.query("hdl_toc")[0])
+
+    def load_info(self) -> list[tuple[str, int, int, str, str, str]]:
+        """
+        Get the disk map and the list of games installed on the HDD at the same time.
+
+        Both hdl-dump queries run concurrently, so it only takes as long as
+        the slowest one. The disk map is cached, and the games list returned.
+        The partition list is read again when next needed, as installs since
+        the last load may have added partitions.
+        """
+        disk_map, games = self.query("map", "hdl_toc")
+        self._disk_map = self.parse_disk_map(disk_map)
+        self._apa_checksum = None
+        self._partitions = None
+        return self.parse_games_list(games)
+
+    @staticmethod
+    def parse_games_list(lines: list[str]) -> list[tuple[str, int, int, str, str, str]]:
+        """Parse the games list from hdl-dump's hdl_toc output, see get_games_list()."""
         # TODO: Add handler for when there's no games installed
-        games = hdl_dump("hdl_toc", self.hdl_target)[1:-1]
+        games = lines[1:-1]
         # [!] will show as the Game Name for any game that was improperly installed
         games = [
             (NEIGHBORING_WHITESPACE.sub(" ", game).split(" ", maxsplit=5) + ["[!]"])[:6]
@@ -219,3 +447,67 @@ class HDD:
         ]
         games.sort(key=lambda x: x[-1])
         return games
+
+
+class RemoteHDD(HDD):
+    """
+    A PS2 HDD in a console on the LAN, running hdl-dump's network server (hdld_svr).
+
+    Everything goes through hdl-dump's network mode, the only protocol the
+    console serves, so its sectors can't be read or written directly and the
+    tools that need to are unavailable. Queries are retried when they time
+    out or fail to reach the console, as a dropped packet is far more likely
+    than a failing drive, but not when hdl-dump fails for any other reason,
+    e.g., a broken APA partition list, as that fails the same every time.
+    Installs are left to hdl-dump's own network protocol.
+    """
+
+    direct_access = False
+
+    def __init__(self, target: str, model: str = "Remote HDD", timeout: float = None, retries: int = None):
+        self.handle = win32file.INVALID_HANDLE_VALUE
+        self.target = target
+        self.hdl_target = target  # hdl-dump takes the console's IP address as the target
+        self.model = model
+        self.timeout = timeout or REMOTE_TIMEOUT
+        self.retries = REMOTE_RETRIES if retries is None else retries
+
+        self._disk_size = None
+        self._disk_map = None
+        self._partitions = None
+
+    @staticmethod
+    def is_connection_error(error: subprocess.CalledProcessError) -> bool:
+        return bool(CONNECTION_ERROR.search((error.stderr or b"") + (error.output or b"")))
+
+    def connect(self, timeout: float = None) -> None:
+        """
+        Check the console is reachable by getting its disk map once, with a short timeout and no retries.
+
+        Used when listing HDDs, so an unreachable target holds up the list for seconds, not minutes.
+        """
+        self._disk_map = self.parse_disk_map(
+            hdl_dump_many([("map", self.hdl_target)], timeout=timeout or REMOTE_CONNECT_TIMEOUT)[0]
+        )
+
+    def query(self, *commands: str) -> list[list[str]]:
+        for attempt in range(self.retries + 1):
+            try:
+                return hdl_dump_many([(x, self.hdl_target) for x in commands], timeout=self.timeout)
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                if attempt == self.retries:
+                    raise
+                if isinstance(e, subprocess.CalledProcessError) and not self.is_connection_error(e):
+                    raise  # e.g., a broken APA partition list, retrying would fail the same
+                metrics.count("remote.retries")
+                time.sleep(min(2 ** attempt * 0.5, 5.0))
+
+    @property
+    def disk_size(self) -> int:
+        """Get the Total Slice Size (in bytes), as the disk itself can't be queried."""
+        return self.disk_map[0]
+
+    @property
+    def is_apa_partitioned(self) -> bool:
+        # hdld_svr only serves the console's APA formatted HDD
+        return True
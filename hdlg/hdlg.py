@@ -16,20 +16,26 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
+import multiprocessing
 import os
 import sys
 
 from PySide2 import QtCore
 from PySide2.QtWidgets import QApplication
 
+from hdlg import metrics
+from hdlg.runner import runner
 from hdlg.config import Directories
 from hdlg.ui.main import Main
 from hdlg.utils import require_admin
 
 
 def main():
+    multiprocessing.freeze_support()  # process pools re-run the entry point on frozen builds
     require_admin()
 
+    metrics.enable(metrics="--metrics" in sys.argv, profile="--profile" in sys.argv)
+
     os.environ["QT_AUTO_SCREEN_SCALE_FACTOR"] = "1"
     QtCore.QCoreApplication.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling)
 
@@ -40,7 +46,13 @@ def main():
     window = Main()
     window.show()
 
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    runner.shutdown()  # don't leave hdl-dump calls running after closing
+    if window.staging:
+        window.staging.close()
+    if metrics.ENABLED:
+        metrics.export()
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
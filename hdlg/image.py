@@ -0,0 +1,204 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+from hdlg import apa, formatter, metrics
+
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+
+class HDDImage:
+    """
+    A raw PS2 HDD image file with the same read interface as HDD.
+
+    It can be used anywhere an HDD is read directly, e.g., cloning to or
+    from a file, or scanning and formatting a synthetic drive.
+
+    The optional read_hook is called with the offset and size of every read
+    before it's made. It may sleep or raise IOError to simulate a slow or
+    failing drive.
+    """
+
+    # whether hdlg can read and write the HDD's sectors itself, and not only through hdl-dump
+    direct_access = True
+
+    def __init__(
+        self,
+        target: Union[str, Path],
+        model: str = "Image",
+        create_size: Optional[int] = None,
+        read_hook: Optional[Callable[[int, int], None]] = None
+    ):
+        self.target = str(target)
+        self.hdl_target = self.target
+        self.model = model
+        self.read_hook = read_hook
+
+        self._partitions = None
+
+        if create_size is not None:
+            with open(self.target, "wb") as f:
+                if os.name == "nt":
+                    # NTFS only leaves holes for unwritten ranges in files explicitly marked as sparse
+                    import msvcrt
+                    import win32file
+                    import winioctlcon
+                    win32file.DeviceIoControl(
+                        msvcrt.get_osfhandle(f.fileno()), winioctlcon.FSCTL_SET_SPARSE, None, None
+                    )
+                f.truncate(create_size)
+
+        self.handle = open(self.target, "r+b", buffering=0)
+        self._position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_, **__):
+        self.dispose()
+
+    def dispose(self):
+        if not self.handle.closed:
+            self.handle.close()
+
+    def seek(self, to: int, whence: int = os.SEEK_SET) -> int:
+        self._position = self.handle.seek(to, whence)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size: int) -> bytes:
+        if size % apa.SECTOR_SIZE != 0:
+            raise ValueError("Size must be a multiple of 512, like an HDD.")
+        if self.read_hook:
+            self.read_hook(self._position, size)
+        with metrics.span("image.read"):
+            data = self.handle.read(size)
+        metrics.count("image.bytes_read", len(data))
+        self._position += len(data)
+        if len(data) < size:
+            raise IOError(f"Read {size - len(data)} less bytes than requested...")
+        return data
+
+    def write(self, data: bytes) -> int:
+        if len(data) % apa.SECTOR_SIZE != 0:
+            raise ValueError("Size must be a multiple of 512, like an HDD.")
+        written = self.handle.write(data)
+        self._position += written
+        return written
+
+    def flush(self) -> None:
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+
+    def discard(self, offset: int, size: int) -> bool:
+        """
+        Deallocate a byte range of the image, leaving a hole that reads as zeros.
+
+        Returns False if the OS or file system doesn't support punching holes.
+        """
+        if os.name == "nt":
+            import msvcrt
+            import pywintypes
+            import win32file
+            import winioctlcon
+            try:
+                # only deallocates on files marked as sparse, otherwise the range is zeroed
+                win32file.DeviceIoControl(
+                    msvcrt.get_osfhandle(self.handle.fileno()), winioctlcon.FSCTL_SET_ZERO_DATA,
+                    struct.pack("<qq", offset, offset + size), None
+                )
+            except pywintypes.error:
+                return False
+            return True
+        if sys.platform.startswith("linux"):
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+            return libc.fallocate(
+                self.handle.fileno(), FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, size
+            ) == 0
+        return False
+
+    def format(self, discard: bool = False) -> list[apa.Partition]:
+        """Format the image for the PS2 with a new APA partition list, see hdlg.formatter."""
+        self._partitions = None
+        return formatter.format_apa(self, discard)
+
+    @property
+    def disk_size(self) -> int:
+        """Get full Disk Size (in bytes)."""
+        return os.fstat(self.handle.fileno()).st_size
+
+    @property
+    def is_apa_partitioned(self) -> bool:
+        """Check if the image is a PS2 APA-formatted device."""
+        old_pos = self.tell()
+        try:
+            return self.disk_size >= apa.HEADER_SIZE and apa.is_valid(apa.read_header(self, 0))
+        finally:
+            self.seek(old_pos)
+
+    @property
+    def apa_checksum(self) -> Optional[bytes]:
+        if not self.is_apa_partitioned:
+            return None
+        old_pos = self.tell()
+        try:
+            return apa.read_header(self, 0)[0:4]
+        finally:
+            self.seek(old_pos)
+
+    @property
+    def partitions(self) -> list[apa.Partition]:
+        """Get the APA partition list."""
+        if self._partitions is not None:
+            return self._partitions
+        old_pos = self.tell()
+        try:
+            self._partitions = apa.read_partitions(self)
+        finally:
+            self.seek(old_pos)
+        return self._partitions
+
+
+def sleep_hook(delays: dict[tuple[int, int], float]) -> Callable[[int, int], None]:
+    """
+    Create a read_hook that sleeps when a read overlaps one of the given byte ranges.
+
+    A delay of a negative number raises an IOError instead, simulating an
+    unreadable sector.
+    """
+    def hook(offset: int, size: int) -> None:
+        for (start, end), delay in delays.items():
+            if offset < end and offset + size > start:
+                if delay < 0:
+                    raise IOError(f"Simulated read error at {start}-{end}")
+                time.sleep(delay)
+    return hook
@@ -0,0 +1,174 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from hdlg import metrics
+from hdlg.config import Directories
+from hdlg.utils import cdvd_info
+
+SUPPORTED_EXTENSIONS = {".iso", ".zso", ".gi", ".cue", ".iml", ".nrg"}
+SCAN_WORKERS = 2
+
+
+def find_games(directory: Path, walked: Optional[set[Path]] = None) -> Iterator[Path]:
+    """Recursively find all files with a supported Game extension, adding every directory walked to `walked`."""
+    for root, _, files in os.walk(directory):
+        if walked is not None:
+            walked.add(Path(root))
+        for file in files:
+            if os.path.splitext(file)[1].lower() in SUPPORTED_EXTENSIONS:
+                yield Path(root, file)
+
+
+class LibraryIndex:
+    """
+    A persistent index of the Games in a library folder.
+
+    Entries are keyed by path and only considered current while the file's
+    size and mtime are unchanged, so only new or changed files need to be
+    identified again. It's safe to use from multiple threads.
+    """
+
+    def __init__(self, root: Path, path: Path = None):
+        self.root = root
+        self.path = path or Directories.data / "library.json"
+        self._lock = threading.Lock()
+        try:
+            saved = json.loads(self.path.read_text("utf8"))
+        except (FileNotFoundError, ValueError):
+            saved = {}
+        self._entries: dict[str, dict] = saved.get("entries", {}) if saved.get("root") == str(root) else {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def entries(self) -> list[dict]:
+        with self._lock:
+            return [dict(entry, path=path) for path, entry in self._entries.items()]
+
+    def is_current(self, path: Path, stat: os.stat_result) -> bool:
+        entry = self._entries.get(str(path))
+        return bool(entry) and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns
+
+    def get(self, path: Path) -> Optional[dict]:
+        """Get a Game's entry, if it's in the index and the file hasn't changed since."""
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if not self.is_current(path, stat):
+                metrics.count("cache_miss.library")
+                return None
+            metrics.count("cache_hit.library")
+            return dict(self._entries[str(path)])
+
+    def update(self, path: Path, stat: os.stat_result, info: Optional[tuple[str, int, str, str]]) -> None:
+        media_type, game_size, label, game_id = info or (None, None, None, None)
+        with self._lock:
+            self._entries[str(path)] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "media_type": media_type,
+                "game_size": game_size,
+                "label": label,
+                "game_id": game_id,
+                "hash_status": "unhashed"
+            }
+
+    def set_hash_status(self, path: Path, status: str) -> None:
+        with self._lock:
+            if str(path) in self._entries:
+                self._entries[str(path)]["hash_status"] = status
+
+    def prune(self, directory: Path, existing: set[str]) -> int:
+        """Remove entries within a directory whose files no longer exist."""
+        prefix = str(directory).rstrip("\\/") + os.sep
+        with self._lock:
+            removed = [x for x in self._entries if x.startswith(prefix) and x not in existing]
+            for path in removed:
+                del self._entries[path]
+        return len(removed)
+
+    def save(self) -> None:
+        with self._lock:
+            data = json.dumps({"root": str(self.root), "entries": self._entries})
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(data, "utf8")
+        os.replace(tmp, self.path)
+
+
+def identify(path: Path) -> Optional[tuple[str, int, str, str]]:
+    """Identify a Game with hdl-dump at a low CPU priority, returning None if it can't be identified."""
+    try:
+        return cdvd_info(path, low_priority=True)
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def scan(
+    index: LibraryIndex,
+    directories: Iterable[Path] = None,
+    workers: int = SCAN_WORKERS,
+    is_cancelled: Callable[[], bool] = lambda: False,
+    walked: Optional[set[Path]] = None
+) -> Iterator[tuple[int, int]]:
+    """
+    Bring the index up to date with the Games in the library, or only within some of its directories.
+
+    Unchanged files are skipped by their size and mtime, so a re-scan costs
+    a directory walk. New and changed files are identified on a small pool
+    so the library's disk (or NAS) isn't saturated. Yields the number of
+    files identified so far and the total to identify. Every directory
+    walked is added to `walked`, e.g., to watch them for changes.
+    """
+    stale = []
+    for directory in directories or [index.root]:
+        existing = set()
+        for path in find_games(directory, walked):
+            existing.add(str(path))
+            stat = path.stat()
+            if not index.is_current(path, stat):
+                stale.append((path, stat))
+        index.prune(directory, existing)
+
+    total, done = len(stale), 0
+    yield done, total
+    if stale:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(identify, path): (path, stat) for path, stat in stale}
+            for future in as_completed(futures):
+                if is_cancelled():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                path, stat = futures[future]
+                index.update(path, stat, future.result())
+                done += 1
+                yield done, total
+    index.save()
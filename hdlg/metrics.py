@@ -0,0 +1,174 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Iterator
+
+from hdlg.config import Directories
+
+# Set HDLG_METRICS=1 (or pass --metrics) to record timing spans and counters, and HDLG_PROFILE=1
+# (or pass --profile) to run every worker job under cProfile. Both are off by default and cost a
+# single boolean check per call site when off.
+ENABLED = bool(os.environ.get("HDLG_METRICS"))
+PROFILE = bool(os.environ.get("HDLG_PROFILE"))
+OUTPUT_DIR = Path(os.environ.get("HDLG_METRICS_DIR") or Directories.data / "metrics")
+MAX_TRACE_EVENTS = 100_000
+
+_lock = threading.Lock()
+_spans: dict[str, list[float]] = defaultdict(lambda: [0, 0.0, 0.0])  # count, total seconds, max seconds
+_counters: dict[str, float] = defaultdict(float)
+_trace: deque = deque(maxlen=MAX_TRACE_EVENTS)
+_epoch = time.perf_counter()
+_noop = nullcontext()  # reusable, so a disabled span doesn't allocate anything
+
+
+def enable(metrics: bool = True, profile: bool = False) -> None:
+    """Enable recording at runtime, e.g., from command-line switches."""
+    global ENABLED, PROFILE
+    ENABLED = ENABLED or metrics
+    PROFILE = PROFILE or profile
+
+
+@contextmanager
+def _span(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        elapsed = end - start
+        with _lock:
+            stats = _spans[name]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            _trace.append({
+                "name": name,
+                "ph": "X",
+                "ts": (start - _epoch) * 1_000_000,
+                "dur": elapsed * 1_000_000,
+                "pid": os.getpid(),
+                "tid": threading.get_ident()
+            })
+
+
+def span(name: str):
+    """Time a block of code, recording its count, total, and max duration, and a trace event."""
+    if not ENABLED:
+        return _noop
+    return _span(name)
+
+
+def count(name: str, n: float = 1) -> None:
+    """Increment a counter, e.g., bytes read or cache hits."""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] += n
+
+
+def timed(name: str) -> Callable:
+    """Decorate a function to run it in a span."""
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with _span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def job(func: Callable) -> Callable:
+    """
+    Decorate a worker job to run it in a span, and under cProfile when profiling is enabled.
+
+    The profile stats of every job run are dumped to their own file, and the
+    trace and Prometheus textfile are exported after every job so they are
+    current even if the app is killed.
+    """
+    name = f"job.{func.__name__}"
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED and not PROFILE:
+            return func(*args, **kwargs)
+        profiler = cProfile.Profile() if PROFILE else None
+        try:
+            with span(name):
+                if profiler:
+                    return profiler.runcall(func, *args, **kwargs)
+                return func(*args, **kwargs)
+        finally:
+            OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+            if profiler:
+                profiler.dump_stats(OUTPUT_DIR / f"{func.__name__}-{datetime.now():%Y%m%d-%H%M%S-%f}.prof")
+            if ENABLED:
+                export()
+    return wrapper
+
+
+def export_trace(path: Path) -> None:
+    """Export all recorded spans as a Chrome Trace Event JSON file (chrome://tracing, Perfetto)."""
+    with _lock:
+        events = list(_trace)
+    path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}), "utf8")
+
+
+def export_prometheus(path: Path) -> None:
+    """Export all span stats and counters as a Prometheus textfile (node_exporter textfile collector)."""
+    with _lock:
+        spans = {k: list(v) for k, v in _spans.items()}
+        counters = dict(_counters)
+    lines = [
+        "# HELP hdlg_span_count Number of times a span was run.",
+        "# TYPE hdlg_span_count counter",
+        *[f'hdlg_span_count{{span="{k}"}} {v[0]}' for k, v in sorted(spans.items())],
+        "# HELP hdlg_span_seconds_total Total time spent in a span.",
+        "# TYPE hdlg_span_seconds_total counter",
+        *[f'hdlg_span_seconds_total{{span="{k}"}} {v[1]:.6f}' for k, v in sorted(spans.items())],
+        "# HELP hdlg_span_seconds_max Longest single run of a span.",
+        "# TYPE hdlg_span_seconds_max gauge",
+        *[f'hdlg_span_seconds_max{{span="{k}"}} {v[2]:.6f}' for k, v in sorted(spans.items())],
+        "# HELP hdlg_counter_total Counters such as bytes read, signal emissions, and cache hits.",
+        "# TYPE hdlg_counter_total counter",
+        *[f'hdlg_counter_total{{name="{k}"}} {int(v) if v.is_integer() else v}' for k, v in sorted(counters.items())],
+    ]
+    # write then rename, so a collector never reads a half-written file
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text("\n".join(lines) + "\n", "utf8")
+    os.replace(tmp, path)
+
+
+def export() -> None:
+    """Export the trace and Prometheus textfile to the metrics output directory."""
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    export_trace(OUTPUT_DIR / "trace.json")
+    export_prometheus(OUTPUT_DIR / "hdlg.prom")
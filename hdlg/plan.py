@@ -0,0 +1,217 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import bisect
+import re
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from hdlg import apa
+
+MIN_PARTITION_SIZE = 128 * 1024 * 1024
+MAX_PARTITION_SIZE = 32 * 1024 * 1024 * 1024
+MAX_PARTITIONS_PER_GAME = 1 + apa.MAX_SUB_PARTITIONS
+CUE_FILE = re.compile(r'^\s*FILE\s+"?(.+?)"?\s+\w+\s*$', re.MULTILINE | re.IGNORECASE)
+
+
+class Projection(NamedTuple):
+    """The outcome of installing games in a specific order."""
+    order: list[Path]
+    installed: list[Path]
+    skipped: list[Path]
+    free: int
+    fragmented: int
+
+
+def probe_size(path: Path) -> int:
+    """Get the size of a game's data, which for a CUE sheet is the total size of the files it references."""
+    if path.suffix.lower() == ".cue":
+        files = CUE_FILE.findall(path.read_text("utf8", errors="replace"))
+        if files:
+            return sum((path.parent / file).stat().st_size for file in files)
+    return path.stat().st_size
+
+
+def max_partition_size(disk_size: int) -> int:
+    """Get the largest partition size hdl-dump would use, 1/32nd of the disk as a power of two within limits."""
+    size = MIN_PARTITION_SIZE
+    while size * 2 <= min(disk_size // 32, MAX_PARTITION_SIZE):
+        size *= 2
+    return size
+
+
+def partition_sizes(size: int, max_partition: int) -> list[int]:
+    """
+    Split a game into the power-of-two partition sizes it would be installed to, largest first.
+
+    This mirrors hdl-dump's allocator closely enough for planning, not exactly.
+    """
+    sizes = []
+    remaining = max(size, 1)
+    while remaining > 0:
+        if remaining >= max_partition:
+            part = max_partition
+        else:
+            part = MIN_PARTITION_SIZE
+            while part < remaining:
+                part *= 2
+            if part > remaining and part > MIN_PARTITION_SIZE:
+                # use the largest partition that fits and leave the rest to smaller partitions, unless
+                # that's just a sliver that would end up wasting more than a minimum size partition
+                if remaining - part // 2 > MIN_PARTITION_SIZE:
+                    part //= 2
+        sizes.append(part)
+        remaining -= part
+    return sizes
+
+
+def free_extents(partitions: list[apa.Partition], disk_size: int) -> list[tuple[int, int]]:
+    """
+    Get the free (offset, size) extents of an APA partitioned disk.
+
+    Deleted partitions are kept as empty partitions in the list, and the
+    space after the last partition is free too. The tail is split into
+    blocks aligned to their size, as APA requires of partitions.
+    """
+    extents = [(p.offset, p.size) for p in partitions if p.is_empty]
+    offset = max((p.offset + p.size for p in partitions), default=0)
+    end = disk_size - (disk_size % MIN_PARTITION_SIZE)
+    while offset + MIN_PARTITION_SIZE <= end:
+        size = MIN_PARTITION_SIZE
+        while offset % (size * 2) == 0 and offset + size * 2 <= end and size < MAX_PARTITION_SIZE:
+            size *= 2
+        extents.append((offset, size))
+        offset += size
+    return extents
+
+
+class Allocator:
+    """
+    A buddy allocator over free APA extents.
+
+    Every free block is aligned to its power-of-two size, and allocating a
+    smaller partition splits the smallest fitting block in halves, just like
+    APA keeps partitions aligned.
+    """
+
+    def __init__(self, extents: list[tuple[int, int]]):
+        self.blocks: dict[int, list[int]] = {}
+        for offset, size in extents:
+            self._add(offset, size)
+
+    def _add(self, offset: int, size: int) -> None:
+        bisect.insort(self.blocks.setdefault(size, []), offset)
+
+    def copy(self) -> Allocator:
+        clone = Allocator([])
+        clone.blocks = {size: list(offsets) for size, offsets in self.blocks.items()}
+        return clone
+
+    def allocate(self, size: int, lowest: bool = False) -> Optional[int]:
+        """
+        Allocate a block of a power-of-two size, returning its offset, or None if nothing fits.
+
+        It splits the smallest fitting block, or with lowest, the fitting block
+        closest to the start of the disk.
+        """
+        fitting = sorted(
+            (offsets[0] if lowest else x, x) for x, offsets in self.blocks.items() if x >= size and offsets
+        )
+        if not fitting:
+            return None
+        block_size = fitting[0][1]
+        offset = self.blocks[block_size].pop(0)
+        while block_size > size:
+            block_size //= 2
+            self._add(offset + block_size, block_size)
+        return offset
+
+    @property
+    def free(self) -> int:
+        return sum(size * len(offsets) for size, offsets in self.blocks.items())
+
+    def free_below(self, size: int) -> int:
+        """Get the free space in blocks smaller than the given size."""
+        return sum(x * len(offsets) for x, offsets in self.blocks.items() if x < size)
+
+    def gaps(self, end: int) -> list[tuple[int, int]]:
+        """Get the free (offset, size) blocks before an offset, e.g., the gaps between allocated partitions."""
+        return sorted((offset, size) for size, offsets in self.blocks.items() for offset in offsets if offset < end)
+
+
+def project(
+    games: list[tuple[Path, int]],
+    extents: list[tuple[int, int]],
+    max_partition: int
+) -> Projection:
+    """
+    Simulate installing games in the given order, skipping those that no longer fit.
+
+    Fragmented space is the free space in blocks smaller than the largest
+    partition size, as it has been split up and only small games or the
+    tail end of large games can use it.
+    """
+    allocator = Allocator(extents)
+    installed, skipped = [], []
+    for path, size in games:
+        sizes = partition_sizes(size, max_partition)
+        attempt = allocator.copy()
+        if len(sizes) <= MAX_PARTITIONS_PER_GAME and all(attempt.allocate(x) is not None for x in sizes):
+            allocator = attempt
+            installed.append(path)
+        else:
+            skipped.append(path)
+    return Projection(
+        order=[path for path, _ in games],
+        installed=installed,
+        skipped=skipped,
+        free=allocator.free,
+        fragmented=allocator.free_below(max_partition)
+    )
+
+
+def plan(games: list[tuple[Path, int]], hdd) -> tuple[Projection, Projection]:
+    """
+    Project installing games in the selected order and in an allocation-aware order.
+
+    The allocation-aware order is first-fit decreasing, installing the largest
+    games first so the large aligned blocks aren't split up by small games
+    before the games that need them get their turn. When not every game fits,
+    the games that fit when installing smallest first are moved to the front
+    too, and whichever order fits more titles (then less fragmentation) wins.
+    """
+    extents = free_extents(hdd.partitions, hdd.disk_size)
+    max_partition = max_partition_size(hdd.disk_size)
+
+    as_selected = project(games, extents, max_partition)
+
+    largest_first = sorted(games, key=lambda x: x[1], reverse=True)
+    candidates = [project(largest_first, extents, max_partition)]
+    if candidates[0].skipped:
+        smallest_first = project(largest_first[::-1], extents, max_partition)
+        fitting = set(smallest_first.installed)
+        candidates.append(project(
+            [x for x in largest_first if x[0] in fitting] + [x for x in largest_first if x[0] not in fitting],
+            extents,
+            max_partition
+        ))
+    optimized = max(candidates, key=lambda x: (len(x.installed), -x.fragmented))
+
+    return as_selected, optimized
@@ -0,0 +1,138 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import subprocess
+import sys
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+from hdlg import metrics
+from hdlg.config import config
+
+DEFAULT_TIMEOUT = 120.0
+DEVICE_CONCURRENCY = 2
+
+
+class Runner:
+    """
+    Run commands like hdl-dump concurrently on an asyncio event loop in a background thread.
+
+    Calls can be submitted from any thread, e.g., worker jobs, and return a
+    Future. At most `per_device` calls run against the same device at once,
+    so queries to one drive don't thrash it while other drives are queried
+    freely. A call that runs past its timeout, or whose Future is cancelled,
+    has its process killed.
+    """
+
+    def __init__(self, per_device: int = DEVICE_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT):
+        self.per_device = per_device
+        self.timeout = timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._semaphores: dict[Optional[str], asyncio.Semaphore] = {}
+        self._calls: dict[Optional[str], set[Future]] = {}
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                # subprocesses on Windows need the proactor loop, the default only from Python 3.8
+                loop = asyncio.ProactorEventLoop() if sys.platform == "win32" else asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="runner", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    async def run(self, args: list[str], device: Optional[str] = None, timeout: Optional[float] = None) -> bytes:
+        """Run a command, returning its output, or raising CalledProcessError or TimeoutExpired like subprocess."""
+        timeout = timeout or self.timeout
+        if device not in self._semaphores:
+            # created within the loop, as before Python 3.10 they bind to the current loop
+            self._semaphores[device] = asyncio.Semaphore(self.per_device)
+        async with self._semaphores[device]:
+            with metrics.span(f"runner.{device}"):
+                process = await asyncio.create_subprocess_exec(
+                    *args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+                )
+                try:
+                    stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+                except asyncio.TimeoutError:
+                    await self._kill(process)
+                    metrics.count("runner.timeouts")
+                    raise subprocess.TimeoutExpired(args, timeout) from None
+                except asyncio.CancelledError:
+                    await self._kill(process)
+                    metrics.count("runner.cancelled")
+                    raise
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, args, stdout, stderr)
+        return stdout
+
+    @staticmethod
+    async def _kill(process: asyncio.subprocess.Process) -> None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            return  # already exited
+        await process.wait()
+
+    def submit(self, args: list[str], device: Optional[str] = None, timeout: Optional[float] = None) -> Future:
+        """Start running a command from any thread, see run()."""
+        future = asyncio.run_coroutine_threadsafe(self.run(args, device, timeout), self._get_loop())
+        with self._lock:
+            self._calls.setdefault(device, set()).add(future)
+
+        def on_done(f: Future) -> None:
+            with self._lock:
+                self._calls[device].discard(f)
+
+        future.add_done_callback(on_done)
+        return future
+
+    def cancel(self, device: Optional[str] = None) -> int:
+        """Cancel and kill the running and queued calls for a device, or of every device if None."""
+        with self._lock:
+            calls = [
+                call
+                for key, calls in self._calls.items() if device is None or key == device
+                for call in calls
+            ]
+        return sum(call.cancel() for call in calls)
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Cancel every call, wait for their processes to be killed, and stop the event loop."""
+        if self._loop is None:
+            return
+        self.cancel()
+
+        async def drain() -> None:
+            tasks = asyncio.all_tasks() - {asyncio.current_task()}
+            if tasks:
+                await asyncio.wait(tasks, timeout=timeout)
+
+        asyncio.run_coroutine_threadsafe(drain(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+
+runner = Runner(
+    per_device=config.hdl_dump.get("concurrency", DEVICE_CONCURRENCY),
+    timeout=config.hdl_dump.get("timeout", DEFAULT_TIMEOUT)
+)
@@ -0,0 +1,234 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from hdlg import apa, formatter
+from hdlg.config import Directories
+
+SCAN_BLOCK_SIZE = 4 * 1024 * 1024
+WHOLE_DISK_REGION_SIZE = 1024 * 1024 * 1024
+SLOW_READ_SECONDS = 0.5
+MAX_FLAGGED = 1000
+# upper bounds (in ms) of the latency histogram buckets, the last bucket catches everything above
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def fingerprint(hdd) -> str:
+    """
+    Get a stable identifier for a drive across sessions and device indexes.
+
+    The creation time of the __mbr partition is only set when formatting,
+    unlike its checksum which changes with every partition added or removed,
+    so a re-formatted drive is considered a new drive with a fresh scan history.
+    """
+    old_pos = hdd.tell()
+    try:
+        header = apa.read_header(hdd, 0)
+    finally:
+        hdd.seek(old_pos)
+    created = header[formatter.CREATED_OFFSET:formatter.CREATED_OFFSET + 8] if apa.is_valid(header) else b""
+    return hashlib.sha1("|".join([
+        hdd.model,
+        str(hdd.disk_size),
+        created.hex()
+    ]).encode()).hexdigest()[:16]
+
+
+def get_regions(hdd, allocated_only: bool) -> list[tuple[str, int, int]]:
+    """
+    Get the (name, offset, size) regions to scan.
+
+    When allocated_only is set, only the regions used by non-empty APA
+    partitions are returned, otherwise the whole disk in 1 GB regions.
+    """
+    if allocated_only:
+        return [
+            (partition.id or f"sector {partition.start}", partition.offset, partition.size)
+            for partition in hdd.partitions
+            if not partition.is_empty
+        ]
+    disk_size = hdd.disk_size - (hdd.disk_size % apa.SECTOR_SIZE)
+    return [
+        (f"{offset // WHOLE_DISK_REGION_SIZE} GB", offset, min(WHOLE_DISK_REGION_SIZE, disk_size - offset))
+        for offset in range(0, disk_size, WHOLE_DISK_REGION_SIZE)
+    ]
+
+
+class ScanReport:
+    """
+    Aggregated surface scan results with a fixed memory footprint.
+
+    Only per-region totals, a fixed-size latency histogram, and a capped
+    list of flagged sectors are kept, no matter how large the drive is.
+    """
+
+    def __init__(self, drive: str, allocated_only: bool):
+        self.drive = drive
+        self.allocated_only = allocated_only
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.finished: Optional[str] = None
+        self.cancelled = False
+        self.regions: list[dict] = []
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.flagged: list[dict] = []
+        self.bytes_read = 0
+        self.seconds = 0.0
+
+    def begin_region(self, name: str, offset: int, size: int) -> None:
+        self.regions.append({
+            "name": name, "offset": offset, "size": size,
+            "bytes_read": 0, "seconds": 0.0, "max_ms": 0.0, "slow": 0, "errors": 0
+        })
+
+    def add_read(self, offset: int, size: int, seconds: float) -> None:
+        region = self.regions[-1]
+        region["bytes_read"] += size
+        region["seconds"] += seconds
+        region["max_ms"] = max(region["max_ms"], seconds * 1000)
+        self.bytes_read += size
+        self.seconds += seconds
+
+        ms = seconds * 1000
+        bucket = next((i for i, limit in enumerate(LATENCY_BUCKETS_MS) if ms <= limit), len(LATENCY_BUCKETS_MS))
+        self.histogram[bucket] += 1
+
+        if seconds >= SLOW_READ_SECONDS:
+            region["slow"] += 1
+            self.flag(offset, size, f"slow read ({ms:.0f} ms)")
+
+    def add_error(self, offset: int, size: int, error: Exception) -> None:
+        self.regions[-1]["errors"] += 1
+        self.flag(offset, size, f"read error ({error})")
+
+    def flag(self, offset: int, size: int, reason: str) -> None:
+        if len(self.flagged) < MAX_FLAGGED:
+            self.flagged.append({
+                "sector": offset // apa.SECTOR_SIZE,
+                "sectors": size // apa.SECTOR_SIZE,
+                "reason": reason
+            })
+
+    @property
+    def throughput(self) -> float:
+        """Mean read throughput in bytes per second."""
+        return self.bytes_read / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "drive": self.drive,
+            "allocated_only": self.allocated_only,
+            "started": self.started,
+            "finished": self.finished,
+            "cancelled": self.cancelled,
+            "bytes_read": self.bytes_read,
+            "seconds": self.seconds,
+            "throughput": self.throughput,
+            "histogram": dict(zip([f"<={x}ms" for x in LATENCY_BUCKETS_MS] + ["slower"], self.histogram)),
+            "regions": self.regions,
+            "flagged": self.flagged
+        }
+
+
+def scan(
+    hdd,
+    allocated_only: bool = False,
+    block_size: int = SCAN_BLOCK_SIZE,
+    is_cancelled: Callable[[], bool] = lambda: False
+) -> Iterator[tuple[ScanReport, int, int]]:
+    """
+    Sequentially read an HDD (or image) and time every read.
+
+    Yields the report with the bytes scanned so far and the total bytes to
+    scan after every block. Blocks that fail to read are re-read sector by
+    sector so only the unreadable sectors are flagged. The last report is
+    final, and is cancelled if is_cancelled() returned True mid-scan. The
+    HDD is left at the position it was at before the scan.
+    """
+    if block_size % apa.SECTOR_SIZE != 0:
+        raise ValueError("Block size must be a multiple of the sector size.")
+
+    report = ScanReport(fingerprint(hdd), allocated_only)
+    regions = get_regions(hdd, allocated_only)
+    total = sum(size for _, _, size in regions)
+    done = 0
+
+    old_pos = hdd.tell()
+    try:
+        for name, offset, size in regions:
+            report.begin_region(name, offset, size)
+            end = offset + size
+            hdd.seek(offset)
+            while offset < end:
+                if is_cancelled():
+                    report.cancelled = True
+                    report.finished = datetime.now().isoformat(timespec="seconds")
+                    yield report, done, total
+                    return
+                n = min(block_size, end - offset)
+                start = time.perf_counter()
+                try:
+                    hdd.read(n)
+                    report.add_read(offset, n, time.perf_counter() - start)
+                except (IOError, OSError):
+                    for sector in range(offset, offset + n, apa.SECTOR_SIZE):
+                        start = time.perf_counter()
+                        try:
+                            hdd.seek(sector)
+                            hdd.read(apa.SECTOR_SIZE)
+                            report.add_read(sector, apa.SECTOR_SIZE, time.perf_counter() - start)
+                        except (IOError, OSError) as e:
+                            report.add_error(sector, apa.SECTOR_SIZE, e)
+                    hdd.seek(offset + n)
+                offset += n
+                done += n
+                yield report, done, total
+    finally:
+        hdd.seek(old_pos)
+
+    report.finished = datetime.now().isoformat(timespec="seconds")
+    yield report, done, total
+
+
+def history_path(drive: str) -> Path:
+    return Directories.data / "scans" / f"{drive}.json"
+
+
+def load_history(drive: str) -> list[dict]:
+    """Get all previously saved scan reports of a drive, oldest first."""
+    try:
+        return json.loads(history_path(drive).read_text("utf8"))
+    except FileNotFoundError:
+        return []
+
+
+def save_report(report: ScanReport) -> list[dict]:
+    """Append a scan report to the drive's history and return the updated history."""
+    history = load_history(report.drive)
+    history.append(report.to_dict())
+    path = history_path(report.drive)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(history, indent=2), "utf8")
+    return history
@@ -0,0 +1,281 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+from hdlg import metrics
+from hdlg.config import Directories
+from hdlg.plan import CUE_FILE
+
+COPY_BLOCK_SIZE = 16 * 1024 * 1024
+DEFAULT_BUDGET = 64 * 1024 * 1024 * 1024
+DEFAULT_READ_AHEAD = 1
+
+
+def game_files(path: Path) -> list[Path]:
+    """Get every file a Game image consists of, which for a CUE sheet includes the files it references."""
+    files = [path]
+    if path.suffix.lower() == ".cue":
+        files += [path.parent / x for x in CUE_FILE.findall(path.read_text("utf8", errors="replace"))]
+    return files
+
+
+def copy_file(source: Path, target: Path, cancelled: threading.Event) -> int:
+    """Copy a file with large sequential reads, returning the CRC32 of the data."""
+    crc = 0
+    buffer = bytearray(COPY_BLOCK_SIZE)
+    view = memoryview(buffer)
+    with open(source, "rb", buffering=0) as f, open(target, "wb", buffering=0) as out:
+        while True:
+            if cancelled.is_set():
+                raise CancelledError()
+            with metrics.span("staging.read"):
+                n = f.readinto(buffer)
+            if not n:
+                break
+            out.write(view[:n])
+            crc = zlib.crc32(view[:n], crc)
+            metrics.count("staging.bytes_copied", n)
+    return crc
+
+
+def file_crc(path: Path) -> int:
+    crc = 0
+    buffer = bytearray(COPY_BLOCK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                return crc
+            crc = zlib.crc32(view[:n], crc)
+
+
+class StagingCache:
+    """
+    A local cache of Game images that are copied ahead of their install.
+
+    While one Game installs, the next ones in the batch are copied from
+    where they are, e.g., a NAS, to a local disk one at a time with large
+    sequential reads, so the install of each reads from local disk while
+    the network transfer of the next overlaps with it.
+
+    Copies are checked against the CRC32 of what was read from the source
+    before they're used, and are only used while the source's size and
+    mtime are unchanged. The least recently used copies are evicted to stay
+    within the size budget, except those in use or about to be.
+    """
+
+    def __init__(self, directory: Path = None, budget: int = DEFAULT_BUDGET, read_ahead: int = DEFAULT_READ_AHEAD):
+        self.directory = directory or Directories.cache / "staging"
+        self.budget = budget
+        self.read_ahead = read_ahead
+        self.index_path = self.directory / "index.json"
+        self._lock = threading.RLock()  # a done callback may run right away, within _prefetch()
+        self._cancelled = threading.Event()
+        self._pending: dict[str, Future] = {}
+        self._reserved: dict[str, int] = {}  # sizes of the pending copies
+        self._in_use: set[str] = set()
+        # one copy at a time, parallel copies from the same share only compete for its bandwidth, and
+        # prefetching runs here too so the source's files are never checked from the caller's thread
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="staging")
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        try:
+            self._entries: dict[str, dict] = json.loads(self.index_path.read_text("utf8"))
+        except (FileNotFoundError, ValueError):
+            self._entries = {}
+        # drop entries whose copies were removed, and copies left behind by an interrupted copy
+        self._entries = {k: v for k, v in self._entries.items() if (self.directory / k).is_dir()}
+        for leftover in self.directory.iterdir():
+            if leftover.is_dir() and leftover.name not in self._entries:
+                shutil.rmtree(leftover, ignore_errors=True)
+
+    @staticmethod
+    def key(path: Path) -> str:
+        return hashlib.sha1(str(path.absolute()).encode("utf8")).hexdigest()[:16]
+
+    @staticmethod
+    def fingerprint(path: Path) -> list[list]:
+        """The name, size, and mtime of every file of a Game, to tell if the source changed."""
+        return [[x.name, x.stat().st_size, x.stat().st_mtime_ns] for x in game_files(path)]
+
+    @property
+    def size(self) -> int:
+        """The size of the cached copies, and of the copies in progress or queued."""
+        return sum(x["size"] for x in self._entries.values()) + sum(self._reserved.values())
+
+    def _save(self) -> None:
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._entries), "utf8")
+        os.replace(tmp, self.index_path)
+
+    def _remove(self, key: str) -> None:
+        self._entries.pop(key, None)
+        shutil.rmtree(self.directory / key, ignore_errors=True)
+
+    def _make_room(self, size: int) -> bool:
+        """Evict the least recently used copies until there's room for a new copy, if possible."""
+        protected = self._in_use | set(self._pending)
+        for key, _ in sorted(self._entries.items(), key=lambda x: x[1]["used"]):
+            if self.size + size <= self.budget:
+                break
+            if key not in protected:
+                self._remove(key)
+                metrics.count("staging.evictions")
+        return self.size + size <= self.budget
+
+    def _stage(self, path: Path, key: str, fingerprint: list, size: int) -> None:
+        target_dir = self.directory / key
+        partial_dir = self.directory / f"{key}.part"
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        try:
+            crcs = {}
+            with metrics.span("staging.copy"):
+                for file in game_files(path):
+                    target = partial_dir / file.relative_to(path.parent)
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    crcs[str(file.relative_to(path.parent))] = copy_file(file, target, self._cancelled)
+            with metrics.span("staging.verify"):
+                for name, crc in crcs.items():
+                    if file_crc(partial_dir / name) != crc:
+                        raise IOError(f"Staged copy of {name} does not match what was read from the source")
+            os.replace(partial_dir, target_dir)
+        except BaseException:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            raise
+        with self._lock:
+            self._entries[key] = {
+                "source": str(path.absolute()),
+                "fingerprint": fingerprint,
+                "size": size,
+                "crcs": crcs,
+                "used": time.time()
+            }
+            self._save()
+
+    def prefetch(self, paths: list[Path]) -> None:
+        """
+        Queue Games to be copied to the cache in order, skipping those already cached or too large.
+
+        It returns right away, e.g., to the UI thread. Checking the Games'
+        files at their source, which may be a slow share, and evicting copies
+        to make room are done on the staging thread, see _prefetch().
+        """
+        if self._cancelled.is_set():
+            return
+        self._pool.submit(self._prefetch, paths[:self.read_ahead])
+
+    def _prefetch(self, paths: list[Path]) -> None:
+        for path in paths:
+            if self._cancelled.is_set():
+                return
+            key = self.key(path)
+            try:
+                fingerprint = self.fingerprint(path)
+            except OSError:
+                continue  # it's up to the install to report missing files
+            size = sum(x[1] for x in fingerprint)
+            with self._lock:
+                if key in self._pending:
+                    continue
+                entry = self._entries.get(key)
+                if key in self._in_use or (entry and entry["fingerprint"] == fingerprint):
+                    continue
+                self._remove(key)
+                if not self._make_room(size):
+                    metrics.count("staging.too_large")
+                    continue
+                try:
+                    future = self._pool.submit(self._stage, path, key, fingerprint, size)
+                except RuntimeError:
+                    return  # closed meanwhile
+                self._reserved[key] = size
+                self._pending[key] = future
+                future.add_done_callback(lambda _, k=key: self.done(k))
+
+    def done(self, key: str) -> None:
+        with self._lock:
+            self._pending.pop(key, None)
+            self._reserved.pop(key, None)
+
+    @contextmanager
+    def use(self, path: Path) -> Iterator[Path]:
+        """
+        Use the cached copy of a Game, if any, or else the Game itself.
+
+        When a copy is still in progress it waits for it, as the rest of the
+        copy is no slower than reading the rest from the source directly.
+        The copy can't be evicted while in use.
+        """
+        key = self.key(path)
+        with self._lock:
+            pending = self._pending.get(key)
+            self._in_use.add(key)
+        try:
+            if pending:
+                try:
+                    pending.result()
+                except Exception:
+                    metrics.count("staging.failed")  # fall back to the source
+            yield self.get(path) or path
+        finally:
+            with self._lock:
+                self._in_use.discard(key)
+
+    def get(self, path: Path) -> Optional[Path]:
+        """Get the cached copy of a Game, if it's cached and the source hasn't changed since."""
+        key = self.key(path)
+        try:
+            fingerprint = self.fingerprint(path)
+        except OSError:
+            fingerprint = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry["fingerprint"] != fingerprint:
+                metrics.count("cache_miss.staging")
+                return None
+            metrics.count("cache_hit.staging")
+            entry["used"] = time.time()
+            self._save()
+        return self.directory / key / path.name
+
+    def verify(self, path: Path) -> bool:
+        """Re-check a cached copy against the CRC32s recorded when it was copied."""
+        key = self.key(path)
+        entry = self._entries.get(key)
+        return bool(entry) and all(
+            file_crc(self.directory / key / name) == crc for name, crc in entry["crcs"].items()
+        )
+
+    def close(self) -> None:
+        """Stop copying, removing any partial copy."""
+        self._cancelled.set()
+        self._pool.shutdown(wait=True)
@@ -1,17 +1,22 @@
 from __future__ import annotations
 
-import re
 import subprocess
 import traceback
 from pathlib import Path
+from typing import Optional, Union
 
 from PySide2 import QtWidgets, QtGui, QtCore
 from PySide2.QtWidgets import QMessageBox
 
+from hdlg import plan
+from hdlg.config import config
+from hdlg.edit import rollback_directory
 from hdlg.hdd import HDD
+from hdlg.library import LibraryIndex
+from hdlg.staging import StagingCache
 from hdlg.ui import BaseWindow
 from hdlg.ui.worker import MainWorker
-from hdlg.utils import size_unit, HDL_DUMP_BIN
+from hdlg.utils import size_unit, cdvd_info
 
 
 class Main(BaseWindow):
@@ -21,10 +26,16 @@ class Main(BaseWindow):
         self.reset_state()
         self.window.setMinimumSize(1000, 400)
         self.window.hddInfoList.header().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
+        self.window.hddInfoList.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+        self.window.hddInfoList.customContextMenuRequested.connect(self.game_context_menu)
 
         # menu bar actions
         self.window.actionExit.triggered.connect(self.window.close)
         self.window.actionAbout.triggered.connect(self.about)
+        self.window.actionCancel.triggered.connect(self.cancel_job)
+        self.window.actionApplyEdits.triggered.connect(self.apply_edits)
+        self.window.actionDiscardEdits.triggered.connect(self.discard_edits)
+        self.window.actionFormat.triggered.connect(self.format_hdd)
 
         # button actions
         self.window.refreshIcon.clicked.connect(self.refresh_hdd_list)
@@ -33,6 +44,18 @@ class Main(BaseWindow):
         # necessary for the thread and worker class
         self.GC_KEEP = None
 
+        self.staging: Optional[StagingCache] = None
+        if config.staging.get("enabled"):
+            self.staging = StagingCache(
+                directory=Path(config.staging["directory"]) if config.staging.get("directory") else None,
+                budget=int(config.staging.get("budget", 64) * 1024 ** 3),
+                read_ahead=config.staging.get("read_ahead", 1)
+            )
+
+        self.library: Optional[LibraryIndex] = None
+        if config.library.get("root"):
+            self.load_library(Path(config.library["root"]))
+
         self.refresh_hdd_list()
 
     def add_hdd_button(self, hdd: HDD) -> None:
@@ -60,6 +83,207 @@ class Main(BaseWindow):
         device_list = self.window.deviceListDevices_2.layout()
         device_list.insertWidget(0 if hdd.is_apa_partitioned else device_list.count() - 1, button)
 
+        self.hdds.append(hdd)
+
+    def set_hdd_tools(self, hdd: Optional[HDD]) -> None:
+        """
+        Connect the Tools menu actions to an HDD, or disconnect and disable them if None.
+
+        The tools read and write the HDD directly, so they're disabled for HDDs only reachable through hdl-dump.
+        """
+        self.tools_hdd = hdd if hdd is not None and hdd.direct_access else None
+        tools = {
+            self.window.actionSurfaceScan: lambda: self.surface_scan(hdd, False),
+            self.window.actionSurfaceScanAllocated: lambda: self.surface_scan(hdd, True),
+            self.window.actionCloneToHdd: lambda: self.clone_to_hdd(hdd),
+            self.window.actionCloneToImage: lambda: self.clone_to_image(hdd),
+            self.window.actionRestoreFromImage: lambda: self.restore_from_image(hdd),
+            self.window.actionUndoEdits: lambda: self.undo_edits(hdd),
+        }
+        for action, tool in tools.items():
+            try:
+                action.triggered.disconnect()
+            except RuntimeError:
+                # has no receiver, it's fine
+                pass
+            if self.tools_hdd:
+                action.triggered.connect(tool)
+            action.setEnabled(self.tools_hdd is not None)
+        if hdd is not None and self.tools_hdd is None:
+            self.edit_session = None
+        elif hdd is not None and (not self.edit_session or self.edit_session.hdd is not hdd):
+            self.edit_session = hdd.edit()
+        self.update_edit_actions()
+
+    def update_edit_actions(self) -> None:
+        """Only allow applying or discarding Game edits when some are staged."""
+        has_edits = bool(self.edit_session) and len(self.edit_session) > 0
+        self.window.actionApplyEdits.setEnabled(has_edits)
+        self.window.actionDiscardEdits.setEnabled(has_edits)
+
+    def enable_hdd_tools(self, enabled: bool) -> None:
+        """Enable or disable the Tools menu actions, e.g., while the HDD is busy."""
+        for action in (
+            self.window.actionSurfaceScan,
+            self.window.actionSurfaceScanAllocated,
+            self.window.actionCloneToHdd,
+            self.window.actionCloneToImage,
+            self.window.actionRestoreFromImage,
+            self.window.actionUndoEdits
+        ):
+            action.setEnabled(enabled and self.tools_hdd is not None)
+        # formatting isn't tied to the loaded HDD, only to nothing else running
+        self.window.actionFormat.setEnabled(enabled)
+        if enabled:
+            self.update_edit_actions()
+        else:
+            self.window.actionApplyEdits.setEnabled(False)
+            self.window.actionDiscardEdits.setEnabled(False)
+
+    def game_context_menu(self, pos: QtCore.QPoint) -> None:
+        """Show a menu to stage edits to the right-clicked Game."""
+        item = self.window.hddInfoList.itemAt(pos)
+        game_id = item.data(0, QtCore.Qt.UserRole) if item else None
+        if not game_id or not self.edit_session or not self.window.hddInfoList.isEnabled():
+            return
+
+        def stage(edit) -> bool:
+            try:
+                edit()
+            except ValueError as e:
+                QMessageBox.warning(self.window, "Invalid Edit", str(e))
+                return False
+            font = item.font(0)
+            font.setItalic(True)
+            item.setFont(0, font)
+            item.setFont(1, font)
+            self.update_edit_actions()
+            self.window.statusbar.showMessage(
+                f"{len(self.edit_session)} Games have unsaved edits, apply them in the Tools menu"
+            )
+            return True
+
+        def rename():
+            name, ok = QtWidgets.QInputDialog.getText(
+                self.window, "Rename Game", f"New name for {game_id}:",
+                text=item.text(1)[len(game_id) + 1:]
+            )
+            if ok and stage(lambda: self.edit_session.rename(game_id, name)):
+                item.setText(1, f"{game_id} {name}")
+
+        def set_flags():
+            flags, ok = QtWidgets.QInputDialog.getInt(
+                self.window, "Set Compatibility Flags", f"Compatibility flags for {game_id} (0-255):",
+                minValue=0, maxValue=255
+            )
+            if ok:
+                stage(lambda: self.edit_session.set_flags(game_id, flags))
+
+        def set_dma():
+            modes = [f"*m{x}" for x in range(3)] + [f"*u{x}" for x in range(7)]
+            dma, ok = QtWidgets.QInputDialog.getItem(
+                self.window, "Set DMA Mode", f"DMA mode for {game_id}:", modes, current=modes.index("*u4"),
+                editable=False
+            )
+            if ok:
+                stage(lambda: self.edit_session.set_dma(game_id, dma))
+
+        menu = QtWidgets.QMenu(self.window)
+        menu.addAction("Rename...", rename)
+        menu.addAction("Set Compatibility Flags...", set_flags)
+        menu.addAction("Set DMA Mode...", set_dma)
+        menu.exec_(self.window.hddInfoList.viewport().mapToGlobal(pos))
+
+    def apply_edits(self) -> None:
+        """Commit all staged Game edits in one write pass, then reload the HDD."""
+        hdd = self.edit_session.hdd
+
+        self.window.deviceListDevices_2.setEnabled(False)
+        self.window.refreshIcon.setEnabled(False)
+        self.window.installButton.setEnabled(False)
+        self.window.hddInfoList.setEnabled(False)
+        self.enable_hdd_tools(False)
+
+        thread = QtCore.QThread()
+        worker = MainWorker()
+        worker.moveToThread(thread)
+
+        def on_finish():
+            thread.quit()
+            self.load_hdd(hdd)
+
+        def on_error(e: Exception):
+            thread.quit()
+            msg = QMessageBox()
+            msg.setIcon(QMessageBox.Critical)
+            msg.setWindowTitle("Failed to apply Game edits")
+            msg.setText("An error occurred when applying Game edits, no edits were applied:")
+            msg.setDetailedText(traceback.format_exc())
+            msg.setInformativeText(str(e))
+            msg.exec_()
+            self.load_hdd(hdd)
+
+        worker.finished.connect(on_finish)
+        worker.error.connect(on_error)
+
+        worker.status_message.connect(self.window.statusbar.showMessage)
+
+        thread.started.connect(lambda: worker.commit_edits(self.edit_session))
+        thread.start()
+
+        self.GC_KEEP = (thread, worker)
+
+    def discard_edits(self) -> None:
+        """Discard all staged Game edits, and reload the HDD to show the unedited Games."""
+        self.edit_session.discard()
+        self.load_hdd(self.edit_session.hdd)
+
+    def undo_edits(self, hdd: HDD) -> None:
+        """Undo previously applied Game edits from one of their rollback copies, then reload the HDD."""
+        filename, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self.window,
+            "Undo Applied Game Edits",
+            str(rollback_directory()),
+            filter="Rollback copies (*.json)"
+        )
+        if not filename:
+            return
+
+        self.window.deviceListDevices_2.setEnabled(False)
+        self.window.refreshIcon.setEnabled(False)
+        self.window.installButton.setEnabled(False)
+        self.window.hddInfoList.setEnabled(False)
+        self.enable_hdd_tools(False)
+
+        thread = QtCore.QThread()
+        worker = MainWorker()
+        worker.moveToThread(thread)
+
+        def on_finish():
+            thread.quit()
+            self.load_hdd(hdd)
+
+        def on_error(e: Exception):
+            thread.quit()
+            msg = QMessageBox()
+            msg.setIcon(QMessageBox.Critical)
+            msg.setWindowTitle("Failed to undo Game edits")
+            msg.setText("An error occurred when undoing Game edits:")
+            msg.setDetailedText(traceback.format_exc())
+            msg.setInformativeText(str(e))
+            msg.exec_()
+            self.load_hdd(hdd)
+
+        worker.finished.connect(on_finish)
+        worker.error.connect(on_error)
+
+        worker.status_message.connect(self.window.statusbar.showMessage)
+
+        thread.started.connect(lambda: worker.rollback_edits(hdd, Path(filename)))
+        thread.start()
+
+        self.GC_KEEP = (thread, worker)
+
     def reset_state(self) -> None:
         """Reset the State of the UI and Application to the initial startup."""
         # Clear all HDD buttons from the HDD list
@@ -91,6 +315,11 @@ class Main(BaseWindow):
         self.window.progressBar.hide()
         self.window.progressBar.setValue(0)
 
+        # Reset the HDD Tools, they need a loaded HDD
+        self.hdds = []
+        self.edit_session = None
+        self.set_hdd_tools(None)
+
         # Enable the Refresh Button
         self.window.refreshIcon.setEnabled(True)
 
@@ -147,6 +376,10 @@ class Main(BaseWindow):
             "Loading PS2 HDD..."
         ]))
 
+        self.enable_hdd_tools(False)
+        # hdl-dump calls of the load are killed when cancelled
+        self.window.actionCancel.setEnabled(True)
+
         thread = QtCore.QThread()
         worker = MainWorker()
         worker.moveToThread(thread)
@@ -158,9 +391,24 @@ class Main(BaseWindow):
             self.window.installButton.show()
             self.window.hddInfoList.setEnabled(True)
             self.window.installButton.clicked.connect(lambda: self.install_game(hdd))
+            self.set_hdd_tools(hdd)
+            self.window.actionCancel.setEnabled(False)
+            thread.quit()
+
+        def on_aborted():
+            # leave the HDD unloaded, but let the user choose another HDD or refresh
+            self.window.hddInfoList.clear()
+            self.window.deviceListDevices_2.setEnabled(True)
+            self.window.refreshIcon.setEnabled(True)
+            self.window.installButton.setEnabled(False)
+            self.window.actionCancel.setEnabled(False)
+            self.set_hdd_tools(None)
+            self.enable_hdd_tools(True)
             thread.quit()
 
         def on_error(e: Exception):
+            # e.g., after an hdl-dump call timed out
+            on_aborted()
             msg = QMessageBox()
             msg.setIcon(QMessageBox.Critical)
             msg.setWindowTitle("Failed to load HDD")
@@ -189,6 +437,7 @@ class Main(BaseWindow):
             self.window.hddInfoList.expandToDepth(0)
 
         worker.finished.connect(on_finish)
+        worker.aborted.connect(on_aborted)
         worker.error.connect(on_error)
 
         worker.status_message.connect(self.window.statusbar.showMessage)
@@ -199,7 +448,360 @@ class Main(BaseWindow):
 
         self.GC_KEEP = (thread, worker)
 
+    def load_library(self, root: Path) -> None:
+        """Load the Game library's index and keep it up to date as files in the library change."""
+        self.library = LibraryIndex(root)
+        # the library is scanned on its own thread, so it doesn't block or get cancelled with HDD jobs
+        self.library_job = None
+        self.library_pending: set[Path] = set()
+
+        self.library_watcher = QtCore.QFileSystemWatcher(self.window)
+        self.library_watcher.directoryChanged.connect(self.library_changed)
+
+        # wait for changes to settle, copying a large image in changes the directory many times
+        self.library_timer = QtCore.QTimer(self.window)
+        self.library_timer.setSingleShot(True)
+        self.library_timer.setInterval(int(config.library.get("debounce", 2.0) * 1000))
+        self.library_timer.timeout.connect(lambda: self.scan_library(self.library_pending))
+
+        self.scan_library({root})
+
+    def library_changed(self, directory: str) -> None:
+        self.library_pending.add(Path(directory))
+        self.library_timer.start()
+
+    def scan_library(self, directories: set[Path]) -> None:
+        """Re-index the Games within the given library directories (and their sub-directories)."""
+        if self.library_job:
+            # the pending directories are scanned once the running scan finishes
+            return
+        directories = [x for x in directories if x.is_dir()] or [self.library.root]
+        self.library_pending = set()
+
+        thread = QtCore.QThread()
+        worker = MainWorker()
+        worker.moveToThread(thread)
+
+        def on_finish():
+            thread.quit()
+            self.library_job = None
+            if self.library_pending:
+                self.library_timer.start()
+
+        def on_directories(walked: list[Path]):
+            # watch new sub-directories, removed ones are dropped by the watcher itself
+            watched = set(self.library_watcher.directories())
+            new = [str(x) for x in walked if str(x) not in watched]
+            if new:
+                self.library_watcher.addPaths(new)
+
+        def on_error(e: Exception):
+            on_finish()
+            self.log.error(f"Failed to index the Game library: {e}")
+
+        worker.library_directories.connect(on_directories)
+        worker.finished.connect(on_finish)
+        worker.error.connect(on_error)
+
+        worker.status_message.connect(self.window.statusbar.showMessage)
+
+        thread.started.connect(lambda: worker.scan_library(self.library, directories))
+        thread.start()
+
+        self.library_job = (thread, worker)
+
+    def pick_library_games(self) -> Optional[list[Path]]:
+        """
+        Let the user choose Games from the library's index.
+
+        Returns the chosen Games, an empty list to browse for files instead,
+        or None if the user cancelled.
+        """
+        dialog = QtWidgets.QDialog(self.window)
+        dialog.setWindowTitle("Select one or more PS2 Games to Install")
+        dialog.resize(900, 500)
+        layout = QtWidgets.QVBoxLayout(dialog)
+
+        search = QtWidgets.QLineEdit(dialog)
+        search.setPlaceholderText("Filter by name, label or Game ID...")
+        layout.addWidget(search)
+
+        games = QtWidgets.QTreeWidget(dialog)
+        games.setHeaderLabels(["Name", "Label", "Game ID", "Media", "Size", "Hash"])
+        games.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        games.setRootIsDecorated(False)
+        games.setSortingEnabled(True)
+        for entry in sorted(self.library.entries(), key=lambda x: x["path"].lower()):
+            path = Path(entry["path"])
+            item = QtWidgets.QTreeWidgetItem([
+                path.stem,
+                entry["label"] or "",
+                entry["game_id"] or "Unidentified",
+                entry["media_type"] or "",
+                size_unit(entry["size"]),
+                entry["hash_status"].title()
+            ])
+            item.setData(0, QtCore.Qt.UserRole, str(path))
+            item.setToolTip(0, str(path))
+            games.addTopLevelItem(item)
+        games.header().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
+        layout.addWidget(games)
+
+        def on_search(text: str):
+            text = text.lower()
+            for i in range(games.topLevelItemCount()):
+                item = games.topLevelItem(i)
+                item.setHidden(bool(text) and not any(text in item.text(x).lower() for x in range(3)))
+
+        search.textChanged.connect(on_search)
+
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Cancel, parent=dialog)
+        install = buttons.addButton("Install", QtWidgets.QDialogButtonBox.AcceptRole)
+        browse = buttons.addButton("Browse Files...", QtWidgets.QDialogButtonBox.ActionRole)
+        install.clicked.connect(dialog.accept)
+        browse.clicked.connect(lambda: dialog.done(2))
+        buttons.rejected.connect(dialog.reject)
+        games.itemDoubleClicked.connect(dialog.accept)
+        layout.addWidget(buttons)
+
+        result = dialog.exec_()
+        if result == 2:
+            return []
+        if result != QtWidgets.QDialog.Accepted:
+            return None
+        return [Path(x.data(0, QtCore.Qt.UserRole)) for x in games.selectedItems()]
+
+    def cancel_job(self) -> None:
+        """Cancel the running cancellable job, if any."""
+        if self.GC_KEEP:
+            _, worker = self.GC_KEEP
+            worker.cancel()
+
+    def surface_scan(self, hdd: HDD, allocated_only: bool):
+        """Scan the HDD's surface for slow or unreadable sectors, showing the results in the information panel."""
+        self.window.deviceListDevices_2.setEnabled(False)
+        self.window.refreshIcon.setEnabled(False)
+        self.window.installButton.setEnabled(False)
+        self.enable_hdd_tools(False)
+        self.window.actionCancel.setEnabled(True)
+        self.window.progressBar.show()
+        self.window.progressBar.setValue(0)
+
+        thread = QtCore.QThread()
+        worker = MainWorker()
+        worker.moveToThread(thread)
+
+        def on_progress(n: float):
+            self.window.progressBar.setValue(n)
+
+        def on_finish():
+            self.window.deviceListDevices_2.setEnabled(True)
+            self.window.refreshIcon.setEnabled(True)
+            self.window.installButton.setEnabled(True)
+            self.enable_hdd_tools(True)
+            self.window.actionCancel.setEnabled(False)
+            self.window.progressBar.hide()
+            thread.quit()
+
+        def on_error(e: Exception):
+            on_finish()
+            msg = QMessageBox()
+            msg.setIcon(QMessageBox.Critical)
+            msg.setWindowTitle("Failed to scan HDD")
+            msg.setText("An error occurred when scanning the HDD's surface:")
+            msg.setDetailedText(traceback.format_exc())
+            msg.setInformativeText(str(e))
+            msg.exec_()
+
+        def set_scan_info(trees: list[QtWidgets.QTreeWidgetItem]):
+            self.window.hddInfoList.clear()
+            for tree in trees:
+                self.window.hddInfoList.addTopLevelItem(tree)
+            self.window.hddInfoList.expandToDepth(0)
+
+        worker.progress.connect(on_progress)
+        worker.finished.connect(on_finish)
+        worker.error.connect(on_error)
+
+        worker.status_message.connect(self.window.statusbar.showMessage)
+        worker.hdd_info.connect(set_scan_info)
+
+        thread.started.connect(lambda: worker.surface_scan(hdd, allocated_only))
+        thread.start()
+
+        self.GC_KEEP = (thread, worker)
+
+    def clone_to_hdd(self, hdd: HDD):
+        """Clone the HDD to another HDD, chosen from the list of HDDs."""
+        targets = {
+            f"{x.hdl_target} ({size_unit(x.disk_size)}) {x.model}": x
+            for x in self.hdds if x is not hdd and x.direct_access
+        }
+        if not targets:
+            QMessageBox.information(self.window, "Clone to HDD", "There are no other HDDs to clone to.")
+            return
+        name, ok = QtWidgets.QInputDialog.getItem(
+            self.window, "Clone to HDD", "Choose the HDD to clone to:", list(targets), editable=False
+        )
+        if ok:
+            self.clone_hdd(hdd, targets[name])
+
+    def clone_to_image(self, hdd: HDD):
+        """Clone the HDD to a new sparse image file."""
+        filename, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self.window,
+            "Clone to Image",
+            filter="Raw disk images (*.img);;All files (*.*)"
+        )
+        if filename:
+            self.clone_hdd(hdd, Path(filename))
+
+    def restore_from_image(self, hdd: HDD):
+        """Clone an image file to the HDD."""
+        filename, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self.window,
+            "Restore from Image",
+            filter="Raw disk images (*.img);;All files (*.*)"
+        )
+        if filename:
+            self.clone_hdd(Path(filename), hdd)
+
+    def clone_hdd(self, source: Union[HDD, Path], target: Union[HDD, Path]):
+        """Clone the allocated partitions of an HDD or image to another HDD or image, after confirming."""
+        if isinstance(target, HDD):
+            answer = QMessageBox.warning(
+                self.window,
+                "Overwrite HDD?",
+                f"Everything on {target.hdl_target} ({target.model}) will be overwritten by {source}. Continue?",
+                QMessageBox.Yes | QMessageBox.No,
+                QMessageBox.No
+            )
+            if answer != QMessageBox.Yes:
+                return
+
+        self.window.deviceListDevices_2.setEnabled(False)
+        self.window.refreshIcon.setEnabled(False)
+        self.window.installButton.setEnabled(False)
+        self.enable_hdd_tools(False)
+        self.window.actionCancel.setEnabled(True)
+        self.window.progressBar.show()
+        self.window.progressBar.setValue(0)
+
+        thread = QtCore.QThread()
+        worker = MainWorker()
+        worker.moveToThread(thread)
+
+        def on_progress(n: float):
+            self.window.progressBar.setValue(n)
+
+        def on_finish():
+            self.window.deviceListDevices_2.setEnabled(True)
+            self.window.refreshIcon.setEnabled(True)
+            self.window.installButton.setEnabled(True)
+            self.enable_hdd_tools(True)
+            self.window.actionCancel.setEnabled(False)
+            self.window.progressBar.hide()
+            thread.quit()
+            if isinstance(target, HDD):
+                # the target's cached information like its partitions and APA checksum are now stale
+                self.refresh_hdd_list()
+
+        def on_error(e: Exception):
+            on_finish()
+            msg = QMessageBox()
+            msg.setIcon(QMessageBox.Critical)
+            msg.setWindowTitle("Failed to clone HDD")
+            msg.setText("An error occurred when cloning the HDD:")
+            msg.setDetailedText(traceback.format_exc())
+            msg.setInformativeText(str(e))
+            msg.exec_()
+
+        worker.progress.connect(on_progress)
+        worker.finished.connect(on_finish)
+        worker.error.connect(on_error)
+
+        worker.status_message.connect(self.window.statusbar.showMessage)
+
+        thread.started.connect(lambda: worker.clone_hdd(source, target))
+        thread.start()
+
+        self.GC_KEEP = (thread, worker)
+
+    def format_hdd(self):
+        """Format an HDD, chosen from the list of HDDs, for use with a PS2 after confirming."""
+        targets = {f"{x.hdl_target} ({size_unit(x.disk_size)}) {x.model}": x for x in self.hdds if x.direct_access}
+        if not targets:
+            QMessageBox.information(self.window, "Format for PS2", "There are no HDDs to format.")
+            return
+        name, ok = QtWidgets.QInputDialog.getItem(
+            self.window, "Format for PS2", "Choose the HDD to format:", list(targets), editable=False
+        )
+        if not ok:
+            return
+        hdd = targets[name]
+
+        msg = QMessageBox(self.window)
+        msg.setIcon(QMessageBox.Warning)
+        msg.setWindowTitle("Format HDD?")
+        msg.setText(
+            f"{hdd.hdl_target} ({hdd.model}) will be formatted for the PS2 and every partition and Game on it "
+            "will be lost. Continue?"
+        )
+        discard = QtWidgets.QCheckBox("Discard (TRIM) all data on the HDD, if supported")
+        msg.setCheckBox(discard)
+        msg.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+        msg.setDefaultButton(QMessageBox.No)
+        if msg.exec_() != QMessageBox.Yes:
+            return
+
+        self.window.deviceListDevices_2.setEnabled(False)
+        self.window.refreshIcon.setEnabled(False)
+        self.window.installButton.setEnabled(False)
+        self.enable_hdd_tools(False)
+
+        thread = QtCore.QThread()
+        worker = MainWorker()
+        worker.moveToThread(thread)
+
+        def on_finish():
+            self.window.deviceListDevices_2.setEnabled(True)
+            self.window.refreshIcon.setEnabled(True)
+            self.window.installButton.setEnabled(True)
+            self.enable_hdd_tools(True)
+            thread.quit()
+            # list the HDD as a PS2 HDD, and drop what was cached of its previous partitions
+            self.refresh_hdd_list()
+
+        def on_error(e: Exception):
+            on_finish()
+            msg = QMessageBox()
+            msg.setIcon(QMessageBox.Critical)
+            msg.setWindowTitle("Failed to format HDD")
+            msg.setText("An error occurred when formatting the HDD:")
+            msg.setDetailedText(traceback.format_exc())
+            msg.setInformativeText(str(e))
+            msg.exec_()
+
+        worker.finished.connect(on_finish)
+        worker.error.connect(on_error)
+
+        worker.status_message.connect(self.window.statusbar.showMessage)
+
+        thread.started.connect(lambda: worker.format_hdd(hdd, discard.isChecked()))
+        thread.start()
+
+        self.GC_KEEP = (thread, worker)
+
     def install_game(self, hdd: HDD):
+        if self.library:
+            filenames = self.pick_library_games()
+            if filenames is None:
+                self.log.debug("Cancelled Installation at the library picker.")
+                return
+            if filenames:
+                self.verify_or_install_games(hdd, filenames)
+                return
+
         filenames = QtWidgets.QFileDialog.getOpenFileNames(
             self.window,
             "Select one or more PS2 Games to Install",
@@ -217,31 +819,202 @@ class Main(BaseWindow):
             self.log.debug("Cancelled Installation as no PS2 Disc Image (ISO) was provided.")
             return
         filenames = [Path(x) for x in filenames[0]]
+        self.verify_or_install_games(hdd, filenames)
+
+    def verify_or_install_games(self, hdd: HDD, filenames: list[Path]):
+        if config.verify.get("enabled") and config.verify.get("dat"):
+            self.verify_games(hdd, filenames, Path(config.verify["dat"]))
+        else:
+            self.install_games(hdd, filenames)
+
+    def verify_games(self, hdd: HDD, filenames: list[Path], dat: Path):
+        """Verify Game images against a Redump DAT, then install the batch if the user agrees."""
+        self.window.deviceListDevices_2.setEnabled(False)
+        self.window.refreshIcon.setEnabled(False)
+        self.window.installButton.setEnabled(False)
+        self.window.progressBar.show()
+        self.window.progressBar.setValue(0)
+
+        thread = QtCore.QThread()
+        worker = MainWorker()
+        worker.moveToThread(thread)
+
+        def on_progress(n: float):
+            self.window.progressBar.setValue(n)
+
+        def on_finish():
+            self.window.deviceListDevices_2.setEnabled(True)
+            self.window.refreshIcon.setEnabled(True)
+            self.window.installButton.setEnabled(True)
+            self.window.progressBar.hide()
+            thread.quit()
+
+        def on_error(e: Exception):
+            on_finish()
+            msg = QMessageBox()
+            msg.setIcon(QMessageBox.Critical)
+            msg.setWindowTitle("Failed to verify Games")
+            msg.setText("An error occurred when verifying Games against the Redump DAT:")
+            msg.setDetailedText(traceback.format_exc())
+            msg.setInformativeText(str(e))
+            msg.exec_()
+
+        def on_verified(results: list[tuple[Path, Optional[tuple[str, str]]]]):
+            on_finish()
+            if self.library:
+                for path, match in results:
+                    self.library.set_hash_status(path, "verified" if match else "unverified")
+                self.library.save()
+            unknown = [path for path, match in results if not match]
+            if not unknown:
+                self.install_games(hdd, filenames)
+                return
+            msg = QMessageBox(self.window)
+            msg.setIcon(QMessageBox.Warning)
+            msg.setWindowTitle("Unverified Games")
+            msg.setText(
+                f"{len(unknown)} of {len(results)} Games did not match any dump in the Redump DAT. "
+                "They may be bad dumps, modified, or simply missing from the DAT."
+            )
+            msg.setDetailedText("\n".join(map(str, unknown)))
+            msg.setInformativeText("Install only the verified Games, or install all of them anyway?")
+            verified_only = msg.addButton("Install Verified", QMessageBox.AcceptRole)
+            install_all = msg.addButton("Install All", QMessageBox.DestructiveRole)
+            msg.addButton(QMessageBox.Cancel)
+            msg.exec_()
+            if msg.clickedButton() == verified_only:
+                self.install_games(hdd, [x for x in filenames if x not in unknown])
+            elif msg.clickedButton() == install_all:
+                self.install_games(hdd, filenames)
+
+        worker.progress.connect(on_progress)
+        worker.verified.connect(on_verified)
+        worker.error.connect(on_error)
+
+        worker.status_message.connect(self.window.statusbar.showMessage)
+
+        thread.started.connect(lambda: worker.verify_games(filenames, dat))
+        thread.start()
+
+        self.GC_KEEP = (thread, worker)
+
+    def install_games(self, hdd: HDD, filenames: list[Path]):
+        """Install a batch of Game images, in the order the user chooses after projecting how it fits."""
+        if len(filenames) < 2 or not hdd.direct_access:
+            # the projection reads the APA partition list directly
+            self.install_batch(hdd, filenames)
+            return
+
+        self.window.deviceListDevices_2.setEnabled(False)
+        self.window.refreshIcon.setEnabled(False)
+        self.window.installButton.setEnabled(False)
+
+        thread = QtCore.QThread()
+        worker = MainWorker()
+        worker.moveToThread(thread)
+
+        def on_finish():
+            self.window.deviceListDevices_2.setEnabled(True)
+            self.window.refreshIcon.setEnabled(True)
+            self.window.installButton.setEnabled(True)
+            thread.quit()
+
+        def on_error(e: Exception):
+            on_finish()
+            # the projection is only advisory, so don't prevent installing without one
+            self.log.warning(f"Unable to plan the installation order: {e}")
+            self.install_batch(hdd, filenames)
+
+        def on_planned(as_selected: plan.Projection, optimized: plan.Projection, identified: dict):
+            on_finish()
+            order = self.order_games(filenames, as_selected, optimized)
+            if not order:
+                self.log.debug("Cancelled Installation at the installation order projection.")
+                return
+            self.install_batch(hdd, order, identified)
+
+        worker.planned.connect(on_planned)
+        worker.error.connect(on_error)
+
+        worker.status_message.connect(self.window.statusbar.showMessage)
+
+        thread.started.connect(lambda: worker.plan_games(hdd, filenames, self.library))
+        thread.start()
+
+        self.GC_KEEP = (thread, worker)
+
+    def order_games(
+        self,
+        filenames: list[Path],
+        as_selected: plan.Projection,
+        optimized: plan.Projection
+    ) -> Optional[list[Path]]:
+        """
+        Show how a batch fits the HDD as selected and in an allocation-aware order, and let the user choose.
+
+        Returns the order to install in, or None if the user cancelled.
+        """
+        msg = QMessageBox(self.window)
+        msg.setIcon(QMessageBox.Question)
+        msg.setWindowTitle("Installation Order")
+        msg.setText("\n".join(
+            f"{name}: {len(projection.installed)} of {len(filenames)} Games fit, "
+            f"{size_unit(projection.free)} free, {size_unit(projection.fragmented)} of which is fragmented."
+            for name, projection in (("As Selected", as_selected), ("Optimized", optimized))
+        ))
+        msg.setInformativeText("Install in the optimized order? Games projected not to fit will be skipped.")
+        msg.setDetailedText("\n".join(
+            f"{'' if x in optimized.installed else '[Does not fit] '}{x.name}" for x in optimized.order
+        ))
+        optimized_button = msg.addButton("Install Optimized", QMessageBox.AcceptRole)
+        selected_button = msg.addButton("Install As Selected", QMessageBox.RejectRole)
+        msg.addButton(QMessageBox.Cancel)
+        msg.setDefaultButton(optimized_button)
+        msg.exec_()
+
+        if msg.clickedButton() == optimized_button:
+            return optimized.installed
+        if msg.clickedButton() == selected_button:
+            return filenames
+        return None
+
+    def install_batch(
+        self,
+        hdd: HDD,
+        filenames: list[Path],
+        identified: Optional[dict[Path, tuple[str, int, str, str]]] = None
+    ):
+        """
+        Install a batch of Game images one after the other.
+
+        Games are identified with hdl-dump before installing, unless they're
+        in the library or in identified, e.g., from projecting the batch.
+        """
+        identified = identified or {}
 
         def _install(index: int = 0):
             if index > len(filenames) - 1:
                 return
             iso_path = filenames[index]
-            # TODO: Verify info cdvd_info
             try:
-                cdvd_info = subprocess.check_output([
-                    HDL_DUMP_BIN,
-                    "cdvd_info2",
-                    str(iso_path)
-                ], stderr=subprocess.PIPE)
-
-                disc_info = re.match(r'^(?:dual-layer )?([^ ]*) +(\d+)KB +"([^"]*)" +"([^"]+)"', cdvd_info.decode())
-                if not disc_info:
-                    QMessageBox.information(
-                        self.window,
-                        "Unable to Identify Game Data",
-                        f"Skipping \"{iso_path}\" as game information like Media Type and ID could not be identified.\n"
-                        f"\n" +
-                        cdvd_info.decode()
-                    )
-                    _install(index + 1)
-                    return
-                media_type, game_size, disc_label, game_id = disc_info.groups()
+                # use what the library has already identified, unless the file changed since
+                entry = self.library.get(iso_path) if self.library else None
+                if entry and entry["game_id"]:
+                    media_type, disc_label, game_id = entry["media_type"], entry["label"], entry["game_id"]
+                elif iso_path in identified:
+                    media_type, _, disc_label, game_id = identified[iso_path]
+                else:
+                    try:
+                        media_type, _, disc_label, game_id = cdvd_info(iso_path)
+                    except ValueError as e:
+                        QMessageBox.information(
+                            self.window,
+                            "Unable to Identify Game Data",
+                            f"Skipping \"{iso_path}\" as game information like Media Type and ID could not be "
+                            f"identified.\n\n{e}"
+                        )
+                        _install(index + 1)
+                        return
 
                 self.window.deviceListDevices_2.setEnabled(False)
                 self.window.refreshIcon.setEnabled(False)
@@ -252,6 +1025,10 @@ class Main(BaseWindow):
                 thread = QtCore.QThread()
                 worker = MainWorker()
                 worker.moveToThread(thread)
+                if self.staging:
+                    # copy the next Games to local disk while this one installs
+                    self.staging.prefetch(filenames[index + 1:])
+                    worker.staging = self.staging
 
                 def on_progress(n: float):
                     self.window.progressBar.setValue(n)
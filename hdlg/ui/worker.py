@@ -1,12 +1,27 @@
+from __future__ import annotations
+
+import subprocess
+import threading
+import time
+from concurrent.futures import CancelledError
+from contextlib import nullcontext
 from pathlib import Path
+from typing import Optional, Union
 
 import pythoncom
-from PySide2.QtCore import QObject, Signal
+from PySide2.QtCore import QObject, Qt, Signal
 from PySide2.QtWidgets import QTreeWidgetItem
 from wmi import WMI
 
-from hdlg.hdd import HDD
-from hdlg.utils import size_unit, hdl_dump_live
+from hdlg import clone, formatter, library, metrics, plan, scan
+from hdlg.config import config
+from hdlg.edit import EditSession, rollback
+from hdlg.hdd import HDD, RemoteHDD
+from hdlg.image import HDDImage
+from hdlg.runner import runner
+from hdlg.staging import StagingCache, game_files
+from hdlg.utils import background_priority, cdvd_info_many, size_unit, hdl_dump_live
+from hdlg.verify import HashCache, RedumpDat, hash_files
 
 
 class MainWorker(QObject):
@@ -17,7 +32,31 @@ class MainWorker(QObject):
     found_device = Signal(HDD)
     hdd_info = Signal(list)
     game = Signal(HDD, Path, str, str, str)
+    verified = Signal(list)
+    aborted = Signal()
+    planned = Signal(object, object, dict)
+    library_directories = Signal(list)
+
+    def __init__(self):
+        super().__init__()
+        # set from the UI thread, as the worker's thread is busy running the job
+        self.cancelled = threading.Event()
+        # devices the job is running hdl-dump calls on, which are killed when cancelled
+        self.devices: set[str] = set()
+        # set by the UI to install Games from their staged copies
+        self.staging: Optional[StagingCache] = None
+        if metrics.ENABLED:
+            for name in ("error", "finished", "progress", "status_message", "found_device", "hdd_info", "verified"):
+                getattr(self, name).connect(lambda *_, n=name: metrics.count(f"signal.{n}"))
 
+    def cancel(self) -> None:
+        """Request the running job to stop at the next opportunity."""
+        self.cancelled.set()
+        # a copy, as the worker's thread may be adding to it
+        for device in list(self.devices):
+            runner.cancel(device)
+
+    @metrics.job
     def find_hdds(self) -> None:
         """
         Find Disk Drive devices using WMI on Windows.
@@ -28,22 +67,42 @@ class MainWorker(QObject):
             self.status_message.emit("Scanning HDDs...")
             # noinspection PyUnresolvedReferences
             pythoncom.CoInitialize()  # important!
-            c = WMI()
-            disk_drives = c.Win32_DiskDrive()
+            with metrics.span("wmi.find_hdds"):
+                c = WMI()
+                disk_drives = c.Win32_DiskDrive()
             for disk_drive in sorted(disk_drives, key=lambda d: d.index):
-                self.found_device.emit(HDD(
-                    target=disk_drive.DeviceID,
-                    model=disk_drive.Model
-                ))
-            self.status_message.emit(f"Found {len(disk_drives)} HDDs")
+                with metrics.span("hdd.open"):
+                    hdd = HDD(
+                        target=disk_drive.DeviceID,
+                        model=disk_drive.Model
+                    )
+                self.found_device.emit(hdd)
+            found = len(disk_drives)
+            for target in config.remote.get("targets", []):
+                self.status_message.emit(f"Connecting to remote HDD {target}...")
+                try:
+                    with metrics.span("remote.find_hdd"):
+                        hdd = RemoteHDD(
+                            target, timeout=config.remote.get("timeout"), retries=config.remote.get("retries")
+                        )
+                        hdd.connect(config.remote.get("connect_timeout"))  # so unreachable targets aren't listed
+                except (OSError, ValueError, subprocess.SubprocessError) as e:
+                    self.status_message.emit(f"Remote HDD {target} is unreachable: {e}")
+                    continue
+                self.found_device.emit(hdd)
+                found += 1
+            self.status_message.emit(f"Found {found} HDDs")
             self.finished.emit()
         except Exception as e:
             self.error.emit(e)
 
+    @metrics.job
     def get_hdd_info(self, hdd: HDD) -> None:
         """Get HDD Usage Information like Total/Used/Available Disk Space and a list of Games."""
         try:
             self.status_message.emit(f"Loading HDD %s (%s)" % (hdd.target, hdd.model))
+            self.devices.add(hdd.hdl_target)
+            games = hdd.load_info()
             disk_usage_percent = [
                 (hdd.disk_map[1] / hdd.disk_map[0]) * 100,  # Used
                 (hdd.disk_map[2] / hdd.disk_map[0]) * 100,  # Available
@@ -59,13 +118,15 @@ class MainWorker(QObject):
                 "Available", f"{size_unit(hdd.disk_map[2])} ({hdd.disk_map[2]}, {disk_usage_percent[1]:.2f}%)"
             ]))
 
-            games = hdd.get_games_list()
-            games_tree = QTreeWidgetItem(["Games", str(len(games))])
-            for media_type, size, _, dma, game_id, name in games:
-                games_tree.addChild(QTreeWidgetItem([
-                    f"{media_type} {size_unit(size)} ({dma})",
-                    f"{game_id} {name}"
-                ]))
+            with metrics.span("ui.build_games_tree"):
+                games_tree = QTreeWidgetItem(["Games", str(len(games))])
+                for media_type, size, _, dma, game_id, name in games:
+                    game_item = QTreeWidgetItem([
+                        f"{media_type} {size_unit(size)} ({dma})",
+                        f"{game_id} {name}"
+                    ])
+                    game_item.setData(0, Qt.UserRole, game_id)
+                    games_tree.addChild(game_item)
 
             self.hdd_info.emit([
                 space_tree,
@@ -73,28 +134,248 @@ class MainWorker(QObject):
             ])
             self.status_message.emit(f"Loaded HDD %s (%s)" % (hdd.target, hdd.model))
             self.finished.emit()
+        except CancelledError:
+            self.status_message.emit("Cancelled loading HDD %s (%s)" % (hdd.target, hdd.model))
+            self.aborted.emit()
         except Exception as e:
             self.error.emit(e)
 
+    @metrics.job
     def install_game(self, hdd: HDD, iso: Path, media_type: str, disc_label: str, game_id: str):
         """Install a Game ISO to a PS2 HDD."""
         try:
             self.status_message.emit(f"Installing {iso.stem} ({game_id})")
-            for line in hdl_dump_live(
-                f"inject_{media_type.lower()}",
-                hdd.hdl_target, iso.stem.title(), str(iso.absolute()), game_id
-            ):
-                progress = line.split(", ")
-                if len(progress) == 3:
-                    progress, remaining, speed = progress
-                else:
-                    progress, remaining, speed = progress[0], None, None
-                self.status_message.emit(", ".join(x for x in [
-                    f"{progress} Installed {iso.stem} ({game_id})", remaining, speed
-                ] if x))
-                progress = float(progress.split("%")[0])
-                self.progress.emit(progress)
+            with self.staging.use(iso) if self.staging else nullcontext(iso) as source:
+                for line in hdl_dump_live(
+                    f"inject_{media_type.lower()}",
+                    hdd.hdl_target, iso.stem.title(), str(source.absolute()), game_id
+                ):
+                    progress = line.split(", ")
+                    if len(progress) == 3:
+                        progress, remaining, speed = progress
+                    else:
+                        progress, remaining, speed = progress[0], None, None
+                    self.status_message.emit(", ".join(x for x in [
+                        f"{progress} Installed {iso.stem} ({game_id})", remaining, speed
+                    ] if x))
+                    progress = float(progress.split("%")[0])
+                    self.progress.emit(progress)
             self.status_message.emit("Installed %s (%s %s)..." % (disc_label, game_id, media_type))
             self.finished.emit()
         except Exception as e:
             self.error.emit(e)
+
+    @metrics.job
+    def verify_games(self, games: list[Path], dat: Path):
+        """Hash Game images and match them against a Redump DAT to find bad dumps before installing."""
+        try:
+            self.status_message.emit(f"Loading Redump DAT {dat.name}")
+            dat = RedumpDat(dat)
+            # a CUE sheet's BIN tracks are what hold the data, so they're hashed and matched too
+            files, missing = {}, set()
+            for game in games:
+                files[game] = game_files(game)
+                if not all(x.is_file() for x in files[game]):
+                    missing.add(game)
+            to_hash = {x for game, paths in files.items() if game not in missing for x in paths}
+            hashed = {}
+            for i, (path, hashes) in enumerate(hash_files(to_hash, HashCache()), start=1):
+                hashed[path] = (path.stat().st_size, hashes)
+                self.status_message.emit(f"Hashed {i}/{len(to_hash)} files to verify with {dat.name or dat.path.name}")
+                self.progress.emit(i / len(to_hash) * 100)
+            results = [
+                (game, None if game in missing else dat.match_game([hashed[x] for x in files[game]]))
+                for game in games
+            ]
+            self.verified.emit(results)
+            self.finished.emit()
+        except Exception as e:
+            self.error.emit(e)
+
+    @metrics.job
+    def plan_games(self, hdd: HDD, games: list[Path], index: Optional[library.LibraryIndex]):
+        """
+        Project how a batch of Games fits the HDD as selected and in an allocation-aware order.
+
+        Games not in the library are identified concurrently, and emitted with
+        the projections so installing them doesn't identify them again.
+        """
+        try:
+            self.status_message.emit("Projecting how %d Games fit HDD %s (%s)" % (len(games), hdd.target, hdd.model))
+            # the install size, as a compressed image (ZSO) installs at its uncompressed size
+            sizes, identified, unknown = {}, {}, []
+            for game in games:
+                entry = index.get(game) if index else None
+                if entry and entry["game_size"]:
+                    sizes[game] = entry["game_size"] * 1024
+                else:
+                    unknown.append(game)
+            if unknown:
+                self.status_message.emit(f"Identifying {len(unknown)} Games not in the library...")
+            for game, info in zip(unknown, cdvd_info_many(unknown)):
+                if isinstance(info, Exception):
+                    sizes[game] = plan.probe_size(game)  # it can't be installed anyway, see Main.install_batch
+                else:
+                    identified[game] = info
+                    sizes[game] = info[1] * 1024
+            self.planned.emit(*plan.plan([(game, sizes[game]) for game in games], hdd), identified)
+        except Exception as e:
+            self.error.emit(e)
+
+    @metrics.job
+    def scan_library(self, index: library.LibraryIndex, directories: list[Path]):
+        """
+        Bring the Game library's index up to date, identifying only new or changed Games.
+
+        The library's folders are walked and stat'ed in background mode, so
+        on Windows it yields I/O to installs and anything else reading the
+        same disk or share.
+        """
+        try:
+            walked = set()
+            with background_priority():
+                for done, total in library.scan(
+                    index, directories or None, is_cancelled=self.cancelled.is_set, walked=walked
+                ):
+                    if total:
+                        self.status_message.emit(f"Indexed {done}/{total} new or changed Games in the library")
+            self.library_directories.emit(sorted(walked))
+            self.finished.emit()
+        except Exception as e:
+            self.error.emit(e)
+
+    @metrics.job
+    def surface_scan(self, hdd: HDD, allocated_only: bool):
+        """Read the whole HDD (or only its allocated APA partitions) and profile read latency."""
+        try:
+            self.status_message.emit("Scanning surface of HDD %s (%s)" % (hdd.target, hdd.model))
+            report, last_percent = None, -1
+            for report, done, total in scan.scan(hdd, allocated_only, is_cancelled=self.cancelled.is_set):
+                percent = int(done / total * 100) if total else 100
+                if percent != last_percent:
+                    # emitting for every block would flood the UI thread with signals
+                    last_percent = percent
+                    self.progress.emit(percent)
+                    self.status_message.emit(
+                        f"{percent}% Scanned {size_unit(done)} of {size_unit(total)}, "
+                        f"{size_unit(report.throughput)}/s, {len(report.flagged)} flagged"
+                    )
+            history = scan.save_report(report)
+
+            scan_tree = QTreeWidgetItem(["Surface Scan", "Cancelled" if report.cancelled else report.finished])
+            scan_tree.addChild(QTreeWidgetItem(["Read", f"{size_unit(report.bytes_read)} in {report.seconds:.1f}s"]))
+            scan_tree.addChild(QTreeWidgetItem(["Throughput", f"{size_unit(report.throughput)}/s"]))
+            if len(history) > 1:
+                previous = history[-2]
+                scan_tree.addChild(QTreeWidgetItem([
+                    "Previous Scan",
+                    f"{size_unit(previous['throughput'])}/s, {len(previous['flagged'])} flagged ({previous['started']})"
+                ]))
+            histogram_tree = QTreeWidgetItem(["Read Latency"])
+            for bucket, count in report.to_dict()["histogram"].items():
+                histogram_tree.addChild(QTreeWidgetItem([bucket, str(count)]))
+            regions_tree = QTreeWidgetItem(["Regions", str(len(report.regions))])
+            for region in report.regions:
+                speed = region["bytes_read"] / region["seconds"] if region["seconds"] else 0
+                regions_tree.addChild(QTreeWidgetItem([
+                    region["name"],
+                    f"{size_unit(speed)}/s, max {region['max_ms']:.0f} ms, "
+                    f"{region['slow']} slow, {region['errors']} errors"
+                ]))
+            flagged_tree = QTreeWidgetItem(["Flagged Sectors", str(len(report.flagged))])
+            for flagged in report.flagged:
+                flagged_tree.addChild(QTreeWidgetItem([
+                    f"{flagged['sector']} (+{flagged['sectors']})", flagged["reason"]
+                ]))
+
+            self.hdd_info.emit([scan_tree, histogram_tree, regions_tree, flagged_tree])
+            self.status_message.emit(
+                "Surface scan of HDD %s %s, %d sectors flagged" % (
+                    hdd.target, ["finished", "cancelled"][report.cancelled], len(report.flagged)
+                )
+            )
+            self.finished.emit()
+        except Exception as e:
+            self.error.emit(e)
+
+    @metrics.job
+    def clone_hdd(self, source: Union[HDD, Path], target: Union[HDD, Path]):
+        """Clone the allocated partitions of an HDD or image to another HDD or image."""
+        images = []
+        try:
+            if isinstance(source, Path):
+                source = HDDImage(source)
+                images.append(source)
+            sparse = isinstance(target, Path)
+            if sparse:
+                target = HDDImage(target, create_size=source.disk_size)
+                images.append(target)
+
+            self.status_message.emit(f"Cloning {source.target} to {target.target}")
+            start, last_percent = time.perf_counter(), -1
+            # an HDD's volumes must be dismounted before writing over them
+            with target.exclusive() if isinstance(target, HDD) else nullcontext():
+                for done, total in clone.clone(source, target, sparse=sparse, is_cancelled=self.cancelled.is_set):
+                    percent = int(done / total * 100) if total else 100
+                    if percent != last_percent:
+                        last_percent = percent
+                        self.progress.emit(percent)
+                        self.status_message.emit(
+                            f"{percent}% Cloned {size_unit(done)} of {size_unit(total)}, "
+                            f"{size_unit(done / max(time.perf_counter() - start, 1e-6))}/s"
+                        )
+
+            if self.cancelled.is_set():
+                self.status_message.emit(f"Cancelled cloning {source.target}, {target.target} is incomplete")
+            else:
+                self.status_message.emit(
+                    f"Cloned {source.target} to {target.target} in {time.perf_counter() - start:.1f}s"
+                )
+            self.finished.emit()
+        except Exception as e:
+            self.error.emit(e)
+        finally:
+            for image in images:
+                image.dispose()
+
+    @metrics.job
+    def format_hdd(self, hdd: HDD, discard: bool):
+        """Format an HDD for the PS2 by writing a new APA partition list."""
+        try:
+            self.status_message.emit(f"Formatting HDD {hdd.target} ({hdd.model})")
+            start = time.perf_counter()
+            partitions = hdd.format(discard)
+            formatter.validate(hdd)
+            self.status_message.emit(
+                f"Formatted HDD {hdd.target} ({hdd.model}) with {len(partitions)} partitions "
+                f"in {time.perf_counter() - start:.1f}s"
+            )
+            self.finished.emit()
+        except Exception as e:
+            self.error.emit(e)
+
+    @metrics.job
+    def commit_edits(self, session: EditSession):
+        """Commit all staged Game edits to the HDD in one write pass."""
+        try:
+            count = len(session)
+            self.status_message.emit(f"Applying edits to {count} Games...")
+            start = time.perf_counter()
+            rollback_path = session.commit()
+            self.status_message.emit(
+                f"Applied edits to {count} Games in {time.perf_counter() - start:.1f}s"
+                + (f", original headers saved to {rollback_path}" if rollback_path else "")
+            )
+            self.finished.emit()
+        except Exception as e:
+            self.error.emit(e)
+
+    def rollback_edits(self, hdd: HDD, path: Path):
+        """Undo applied Game edits by writing back the original headers from their rollback copy."""
+        try:
+            self.status_message.emit(f"Undoing the Game edits saved in {path.name}...")
+            count = rollback(hdd, path)
+            self.status_message.emit(f"Restored the original headers of {count} Games from {path.name}")
+            self.finished.emit()
+        except Exception as e:
+            self.error.emit(e)
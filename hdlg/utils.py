@@ -1,15 +1,24 @@
 import ctypes
+import os
 import re
 import shutil
 import subprocess
 import sys
-from typing import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+from hdlg import metrics
+from hdlg.runner import runner
 
 HDL_DUMP_BIN = shutil.which("hdl-dump") or shutil.which("hdl_dump")
 NEIGHBORING_WHITESPACE = re.compile(r"[\s]{2,}")
 CAMEL_TO_SNAKE_1 = re.compile(r"(.)([A-Z][a-z]+)")
 CAMEL_TO_SNAKE_2 = re.compile(r"([a-z0-9])([A-Z])")
 SIZE_UNITS = ["B", "KB", "MB", "GB", "TB", "PB"]
+THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+THREAD_MODE_BACKGROUND_END = 0x00020000
+CDVD_INFO = re.compile(r'^(?:dual-layer )?([^ ]*) +(\d+)KB +"([^"]*)" +"([^"]+)"')
 
 
 def is_admin() -> bool:
@@ -76,16 +85,119 @@ def size_unit(size, base=1000):
     return "%s %s" % (f, SIZE_UNITS[i])
 
 
-def hdl_dump(*args) -> list[str]:
+@contextmanager
+def background_priority() -> Iterator[None]:
+    """
+    Run the current thread in background processing mode, lowering its I/O priority along with its CPU priority.
+
+    This only applies to Windows, elsewhere a thread's priority can't be
+    raised back once lowered without privileges, so it's left as is.
+    """
+    if sys.platform != "win32":
+        yield
+        return
+    kernel32 = ctypes.windll.kernel32
+    # fails if already in background mode, in which case it's not ours to end
+    began = kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_MODE_BACKGROUND_BEGIN)
+    try:
+        yield
+    finally:
+        if began:
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_MODE_BACKGROUND_END)
+
+
+def hdl_dump(*args, timeout: Optional[float] = None) -> list[str]:
     """Make a call to hdl-dump and return the string output."""
-    res = subprocess.check_output([HDL_DUMP_BIN, *args])
-    return res.decode().splitlines()
+    return hdl_dump_many([args], timeout)[0]
+
+
+def hdl_dump_many(calls: list[tuple[str, ...]], timeout: Optional[float] = None) -> list[list[str]]:
+    """
+    Make several calls to hdl-dump concurrently and return their string outputs in order.
+
+    The second argument of a call, the target, is used as the device to cap
+    concurrent calls per device, see hdlg.runner. If any call fails, times
+    out, or is cancelled, the others are cancelled too.
+    """
+    futures = []
+    for args in calls:
+        metrics.count(f"hdl_dump.{args[0]}.calls")
+        device = args[1] if len(args) > 1 else None
+        futures.append(runner.submit([HDL_DUMP_BIN, *args], device=device, timeout=timeout))
+    try:
+        with metrics.span(f"hdl_dump.{'+'.join(args[0] for args in calls)}"):
+            return [future.result().decode().splitlines() for future in futures]
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
 
 
 def hdl_dump_live(*args) -> Iterator[str]:
     """Make a call to hdl-dump and return every line as they are written to the std."""
-    res = subprocess.Popen([HDL_DUMP_BIN, *args], stdout=subprocess.PIPE, bufsize=1, universal_newlines=True)
-    while res.poll() is None:
-        line = res.stdout.readline()
-        if line:
-            yield line.strip()
+    metrics.count(f"hdl_dump.{args[0]}.calls")
+    with metrics.span(f"hdl_dump.{args[0]}"):
+        res = subprocess.Popen([HDL_DUMP_BIN, *args], stdout=subprocess.PIPE, bufsize=1, universal_newlines=True)
+        while res.poll() is None:
+            line = res.stdout.readline()
+            if line:
+                yield line.strip()
+
+
+def cdvd_info(path: Path, low_priority: bool = False) -> tuple[str, int, str, str]:
+    """
+    Identify a Game's media type, size (in KB), disc label and Game ID with hdl-dump.
+
+    With low_priority, hdl-dump is run at the lowest CPU priority (idle on
+    Windows, niceness 19 elsewhere). Linux's CFQ and BFQ I/O schedulers
+    also lower its I/O priority by its niceness, but on Windows its reads
+    stay at normal I/O priority, though identifying a Game only reads a few
+    sectors of it.
+    """
+    kwargs = {}
+    if low_priority:
+        if sys.platform == "win32":
+            kwargs["creationflags"] = subprocess.IDLE_PRIORITY_CLASS
+        else:
+            kwargs["preexec_fn"] = lambda: os.nice(19)
+    metrics.count("hdl_dump.cdvd_info2.calls")
+    with metrics.span("hdl_dump.cdvd_info2"):
+        output = subprocess.check_output([HDL_DUMP_BIN, "cdvd_info2", str(path)], stderr=subprocess.PIPE, **kwargs)
+    return parse_cdvd_info(path, output)
+
+
+def cdvd_info_many(paths: list[Path]) -> list[Union[tuple[str, int, str, str], Exception]]:
+    """
+    Identify several Games with hdl-dump concurrently, see cdvd_info().
+
+    The calls run through hdlg.runner with each Game's folder as the device,
+    so Games on the same disk or share are only read a few at a time. Returns
+    the results in order, with the error in place of any Game that couldn't
+    be identified, so one bad image doesn't fail the rest.
+    """
+    futures = []
+    for path in paths:
+        metrics.count("hdl_dump.cdvd_info2.calls")
+        futures.append(runner.submit([HDL_DUMP_BIN, "cdvd_info2", str(path)], device=str(path.parent)))
+    results = []
+    try:
+        with metrics.span("hdl_dump.cdvd_info2_many"):
+            for path, future in zip(paths, futures):
+                try:
+                    results.append(parse_cdvd_info(path, future.result()))
+                except (subprocess.CalledProcessError, subprocess.TimeoutExpired, ValueError) as e:
+                    results.append(e)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    return results
+
+
+def parse_cdvd_info(path: Path, output: bytes) -> tuple[str, int, str, str]:
+    """Parse a Game's media type, size (in KB), disc label and Game ID from hdl-dump's cdvd_info2 output."""
+    disc_info = CDVD_INFO.match(output.decode("utf8").strip())
+    if not disc_info:
+        raise ValueError(f"Unexpected output from hdl-dump while identifying {path.name}: {output!r}")
+    media_type, game_size, disc_label, game_id = disc_info.groups()
+    return media_type, int(game_size), disc_label, game_id
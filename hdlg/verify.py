@@ -0,0 +1,206 @@
+"""
+hdlg - Modern GUI for hdl-dump.
+Copyright (C) 2021-2022 rlaphoenix
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+from xml.etree import ElementTree
+
+from hdlg import metrics
+from hdlg.config import Directories
+
+HASH_BUFFER_SIZE = 16 * 1024 * 1024
+
+
+def hash_file(path: Union[str, Path]) -> dict[str, str]:
+    """
+    Compute the CRC32, MD5, and SHA-1 of a file in a single pass.
+
+    The file is read sequentially into one reused buffer so every byte is
+    only read from disk once no matter how many digests are computed.
+    """
+    crc32 = 0
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            chunk = view[:n]
+            crc32 = zlib.crc32(chunk, crc32)
+            md5.update(chunk)
+            sha1.update(chunk)
+    return {
+        "crc32": "%08x" % crc32,
+        "md5": md5.hexdigest(),
+        "sha1": sha1.hexdigest()
+    }
+
+
+class HashCache:
+    """Persistent cache of file hashes keyed by path, invalidated by size and mtime."""
+
+    def __init__(self, path: Path = None):
+        self.path = path or Directories.cache / "hashes.json"
+        try:
+            self._entries = json.loads(self.path.read_text("utf8"))
+        except (FileNotFoundError, ValueError):
+            self._entries = {}
+
+    def get(self, path: Path) -> Optional[dict[str, str]]:
+        entry = self._entries.get(str(path.absolute()))
+        if entry:
+            stat = path.stat()
+            if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                metrics.count("cache_hit.hashes")
+                return entry["hashes"]
+        metrics.count("cache_miss.hashes")
+        return None
+
+    def set(self, path: Path, hashes: dict[str, str]) -> None:
+        stat = path.stat()
+        self._entries[str(path.absolute())] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hashes": hashes
+        }
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self._entries), "utf8")
+
+
+class RedumpDat:
+    """Hash index of a Redump (Logiqx XML) DAT file."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.name = None
+        self._by_sha1: dict[str, tuple[str, str]] = {}
+        self._by_md5: dict[str, tuple[str, str]] = {}
+        self._by_crc32: dict[tuple[int, str], tuple[str, str]] = {}
+
+        for _, element in ElementTree.iterparse(self.path):
+            if element.tag == "name" and self.name is None:
+                self.name = element.text
+            elif element.tag == "game":
+                game_name = element.get("name")
+                for rom in element.iter("rom"):
+                    entry = (game_name, rom.get("name"))
+                    if rom.get("sha1"):
+                        self._by_sha1[rom.get("sha1").lower()] = entry
+                    if rom.get("md5"):
+                        self._by_md5[rom.get("md5").lower()] = entry
+                    if rom.get("crc") and rom.get("size"):
+                        self._by_crc32[(int(rom.get("size")), rom.get("crc").lower())] = entry
+                element.clear()
+
+    def __len__(self) -> int:
+        return len(self._by_sha1) or len(self._by_md5) or len(self._by_crc32)
+
+    def match(self, size: int, hashes: dict[str, str]) -> Optional[tuple[str, str]]:
+        """Get the Game and ROM name matching the hashes, or None if it's not a known good dump."""
+        return (
+            self._by_sha1.get(hashes["sha1"]) or
+            self._by_md5.get(hashes["md5"]) or
+            self._by_crc32.get((size, hashes["crc32"]))
+        )
+
+    def match_game(self, files: list[tuple[int, dict[str, str]]]) -> Optional[tuple[str, str]]:
+        """
+        Match every file of a Game, e.g., a CUE sheet and its BIN tracks, against the DAT.
+
+        It's only a known good dump if every file matches a ROM of the same
+        Game. Returns the match of the first file, the one that was selected.
+        """
+        matches = [self.match(size, hashes) for size, hashes in files]
+        if not matches or not all(matches) or len({game for game, _ in matches}) != 1:
+            return None
+        return matches[0]
+
+
+def hash_files(
+    paths: Iterable[Path],
+    cache: Optional[HashCache] = None,
+    max_workers: Optional[int] = None
+) -> Iterator[tuple[Path, dict[str, str]]]:
+    """
+    Hash many files across a process pool, yielding each result as it completes.
+
+    Files already in the cache with an unchanged size and mtime are yielded
+    immediately without being read.
+    """
+    pending = []
+    for path in paths:
+        hashes = cache.get(path) if cache else None
+        if hashes:
+            yield path, hashes
+        else:
+            pending.append(path)
+
+    if not pending:
+        return
+
+    with ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count() or 1, len(pending))) as pool:
+        futures = {pool.submit(hash_file, path): path for path in pending}
+        for future in as_completed(futures):
+            path = futures[future]
+            hashes = future.result()
+            if cache:
+                cache.set(path, hashes)
+            yield path, hashes
+
+    if cache:
+        cache.save()
+
+
+def benchmark(paths: list[Path], worker_counts: Iterable[int] = None) -> list[tuple[int, float]]:
+    """
+    Measure hashing throughput in GB/s for each process pool size.
+
+    The cache is bypassed so each run hashes every file in full. Run it on
+    more files than the largest worker count, and preferably on files that
+    are already in the OS file cache, otherwise it's the disk being measured.
+    """
+    worker_counts = worker_counts or sorted({1, 2, 4, 8, os.cpu_count() or 1})
+    total_size = sum(path.stat().st_size for path in paths)
+    results = []
+    for workers in worker_counts:
+        start = time.perf_counter()
+        for _ in hash_files(paths, max_workers=workers):
+            pass
+        elapsed = time.perf_counter() - start
+        results.append((workers, total_size / elapsed / 1000 ** 3))
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+
+    for count, speed in benchmark([Path(x) for x in sys.argv[1:]]):
+        print(f"{count:>3} workers: {speed:.2f} GB/s")